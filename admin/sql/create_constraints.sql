@@ -1,2 +1,3 @@
 ALTER TABLE item
-  ADD CONSTRAINT item_unique_mbid_scraper_id UNIQUE (mbid, scraper_id);
+  -- item is partitioned by scraper_id, so unique constraints must include it
+  ADD CONSTRAINT item_unique_mbid_scraper_id UNIQUE (scraper_id, mbid);
@@ -10,10 +10,15 @@ ALTER TABLE item
 
 ALTER TABLE item_data
   ADD CONSTRAINT item_data_fk_item
-  FOREIGN KEY (item_id)
-    REFERENCES item (id)
+  FOREIGN KEY (item_id, scraper_id)
+    REFERENCES item (id, scraper_id)
   ON DELETE CASCADE;
 
+ALTER TABLE item_data
+  ADD CONSTRAINT item_data_fk_item_data_blob
+  FOREIGN KEY (data_hash)
+    REFERENCES item_data_blob (hash);
+
 ALTER TABLE recording_release_group
   ADD CONSTRAINT recording_release_group_fk_recording
   FOREIGN KEY (recording_mbid)
@@ -43,3 +48,13 @@ ALTER TABLE recording_redirect
   ADD CONSTRAINT recording_redirect_recording_new_mbid
   FOREIGN KEY (new_mbid)
     REFERENCES recording (mbid);
+
+ALTER TABLE item_tag
+  ADD CONSTRAINT item_tag_fk_scraper
+  FOREIGN KEY (scraper_id)
+    REFERENCES scraper (id);
+
+ALTER TABLE scrape_queue
+  ADD CONSTRAINT scrape_queue_fk_scraper
+  FOREIGN KEY (scraper_id)
+    REFERENCES scraper (id);
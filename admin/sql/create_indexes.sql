@@ -1,5 +1,5 @@
 CREATE INDEX item_ndx_mbid ON item (mbid);
-CREATE INDEX item_ndx_scraper_id ON item (scraper_id);
+-- item is partitioned by scraper_id, so it doesn't need an index on it
 CREATE INDEX item_ndx_added ON item (added);
 
 CREATE INDEX source_ndx_name ON source (name);
@@ -11,3 +11,7 @@ CREATE INDEX recording_release_group_ndx_recording_mbid ON recording_release_gro
 CREATE INDEX recording_release_group_ndx_release_group_mbid ON recording_release_group (release_group_mbid);
 
 CREATE INDEX recording_redirect_mbid_pair ON recording_redirect (mbid, new_mbid);
+
+CREATE INDEX item_tag_ndx_tag_weight ON item_tag (tag, scraper_id, weight, mbid);
+
+CREATE INDEX scrape_queue_ndx_claim ON scrape_queue (scraper_id, state, lease_expires);
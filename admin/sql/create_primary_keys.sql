@@ -5,5 +5,9 @@ ALTER TABLE release_group_meta ADD CONSTRAINT release_group_meta_pkey PRIMARY KE
 
 ALTER TABLE source ADD CONSTRAINT source_pkey PRIMARY KEY (id);
 ALTER TABLE scraper ADD CONSTRAINT scraper_pkey PRIMARY KEY (id);
-ALTER TABLE item ADD CONSTRAINT item_pkey PRIMARY KEY (id);
-ALTER TABLE item_data ADD CONSTRAINT item_data_pkey PRIMARY KEY (item_id);
+-- Keys of partitioned tables must include the partition key
+ALTER TABLE item ADD CONSTRAINT item_pkey PRIMARY KEY (id, scraper_id);
+ALTER TABLE item_data ADD CONSTRAINT item_data_pkey PRIMARY KEY (item_id, scraper_id);
+ALTER TABLE item_data_blob ADD CONSTRAINT item_data_blob_pkey PRIMARY KEY (hash);
+ALTER TABLE item_tag ADD CONSTRAINT item_tag_pkey PRIMARY KEY (scraper_id, mbid, tag);
+ALTER TABLE scrape_queue ADD CONSTRAINT scrape_queue_pkey PRIMARY KEY (scraper_id, mbid);
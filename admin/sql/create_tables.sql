@@ -47,16 +47,48 @@ CREATE TABLE scraper (
   added       TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- item and item_data are partitioned with one partition for each scraper,
+-- created by data.add_scraper. Rows for a scraper without a partition go
+-- into the default partition.
 CREATE TABLE item (
   id          SERIAL,
   mbid        UUID    NOT NULL, -- FK to recording.mbid or release_group.mbid
   scraper_id  INTEGER NOT NULL, -- FK to scraper.id
   added       TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-);
+) PARTITION BY LIST (scraper_id);
+
+CREATE TABLE item_default PARTITION OF item DEFAULT;
 
 CREATE TABLE item_data (
   item_id     INTEGER  NOT NULL, -- FK to item.id
-  data        JSONB
+  scraper_id  INTEGER  NOT NULL, -- the scraper_id of the item, FK to scraper.id
+  data_hash   BYTEA    NOT NULL  -- FK to item_data_blob.hash
+) PARTITION BY LIST (scraper_id);
+
+CREATE TABLE item_data_default PARTITION OF item_data DEFAULT;
+
+-- Each distinct payload is stored once, and shared by all items which have it
+CREATE TABLE item_data_blob (
+  hash        BYTEA    NOT NULL, -- sha256 of data::text
+  data        JSONB    NOT NULL
+);
+
+-- Tags of each item, taken from item data by the scraper module's parse_tags
+CREATE TABLE item_tag (
+  scraper_id  INTEGER NOT NULL, -- FK to scraper.id
+  mbid        UUID    NOT NULL, -- item.mbid
+  tag         TEXT    NOT NULL, -- lowercase
+  weight      INTEGER NOT NULL
+);
+
+CREATE TABLE scrape_queue (
+  scraper_id    INTEGER NOT NULL, -- FK to scraper.id
+  mbid          UUID    NOT NULL, -- recording.mbid or release_group.mbid
+  state         scrape_queue_state NOT NULL DEFAULT 'pending',
+  attempts      INTEGER NOT NULL DEFAULT 0,
+  lease_expires TIMESTAMP WITH TIME ZONE, -- a claimed item can be claimed again after this time
+  last_error    TEXT,
+  added         TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
 CREATE TABLE token (
@@ -1 +1,2 @@
-CREATE TYPE scraper_type AS ENUM ('release_group', 'recording');
\ No newline at end of file
+CREATE TYPE scraper_type AS ENUM ('release_group', 'recording');
+CREATE TYPE scrape_queue_state AS ENUM ('pending', 'claimed', 'failed');
@@ -0,0 +1,21 @@
+-- Add the item_tag table to an existing database.
+-- Fill it for existing items with manage.py index_tags
+BEGIN;
+
+CREATE TABLE item_tag (
+  scraper_id  INTEGER NOT NULL, -- FK to scraper.id
+  mbid        UUID    NOT NULL, -- item.mbid
+  tag         TEXT    NOT NULL, -- lowercase
+  weight      INTEGER NOT NULL
+);
+
+ALTER TABLE item_tag ADD CONSTRAINT item_tag_pkey PRIMARY KEY (scraper_id, mbid, tag);
+
+ALTER TABLE item_tag
+  ADD CONSTRAINT item_tag_fk_scraper
+  FOREIGN KEY (scraper_id)
+    REFERENCES scraper (id);
+
+CREATE INDEX item_tag_ndx_tag_weight ON item_tag (tag, scraper_id, weight, mbid);
+
+COMMIT;
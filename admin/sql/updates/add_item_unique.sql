@@ -0,0 +1,8 @@
+-- Add the unique constraint on item (scraper_id, mbid) to databases which
+-- were created without it. add_items_bulk relies on it to skip existing items.
+BEGIN;
+
+ALTER TABLE item
+  ADD CONSTRAINT item_unique_mbid_scraper_id UNIQUE (scraper_id, mbid);
+
+COMMIT;
@@ -0,0 +1,25 @@
+-- Add the scrape_queue table to an existing database
+BEGIN;
+
+CREATE TYPE scrape_queue_state AS ENUM ('pending', 'claimed', 'failed');
+
+CREATE TABLE scrape_queue (
+  scraper_id    INTEGER NOT NULL, -- FK to scraper.id
+  mbid          UUID    NOT NULL, -- recording.mbid or release_group.mbid
+  state         scrape_queue_state NOT NULL DEFAULT 'pending',
+  attempts      INTEGER NOT NULL DEFAULT 0,
+  lease_expires TIMESTAMP WITH TIME ZONE, -- a claimed item can be claimed again after this time
+  last_error    TEXT,
+  added         TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE scrape_queue ADD CONSTRAINT scrape_queue_pkey PRIMARY KEY (scraper_id, mbid);
+
+ALTER TABLE scrape_queue
+  ADD CONSTRAINT scrape_queue_fk_scraper
+  FOREIGN KEY (scraper_id)
+    REFERENCES scraper (id);
+
+CREATE INDEX scrape_queue_ndx_claim ON scrape_queue (scraper_id, state, lease_expires);
+
+COMMIT;
@@ -0,0 +1,35 @@
+-- Move item_data payloads into item_data_blob, storing each distinct payload once.
+-- Run VACUUM FULL item_data afterwards to return the freed space to the OS.
+-- Run this after partition_item.sql.
+BEGIN;
+
+CREATE TABLE item_data_blob (
+  hash        BYTEA    NOT NULL, -- sha256 of data::text
+  data        JSONB    NOT NULL
+);
+
+ALTER TABLE item_data ADD COLUMN data_hash BYTEA;
+
+UPDATE item_data
+   SET data_hash = sha256(convert_to(data::text, 'UTF8'))
+ WHERE data IS NOT NULL;
+
+INSERT INTO item_data_blob (hash, data)
+     SELECT DISTINCT ON (data_hash) data_hash
+          , data
+       FROM item_data
+      WHERE data IS NOT NULL;
+
+DELETE FROM item_data WHERE data IS NULL;
+
+ALTER TABLE item_data DROP COLUMN data;
+ALTER TABLE item_data ALTER COLUMN data_hash SET NOT NULL;
+
+ALTER TABLE item_data_blob ADD CONSTRAINT item_data_blob_pkey PRIMARY KEY (hash);
+
+ALTER TABLE item_data
+  ADD CONSTRAINT item_data_fk_item_data_blob
+  FOREIGN KEY (data_hash)
+    REFERENCES item_data_blob (hash);
+
+COMMIT;
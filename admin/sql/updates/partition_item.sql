@@ -0,0 +1,83 @@
+-- Move item and item_data into tables partitioned by scraper_id, with one
+-- partition for each existing scraper. Requires PostgreSQL 12.
+-- Run this before deduplicate_item_data.sql: it expects item_data to still
+-- have its data column.
+BEGIN;
+
+ALTER TABLE item_data DROP CONSTRAINT IF EXISTS item_data_fk_item;
+ALTER TABLE item_data DROP CONSTRAINT IF EXISTS item_data_pkey;
+ALTER TABLE item DROP CONSTRAINT IF EXISTS item_pkey;
+ALTER TABLE item DROP CONSTRAINT IF EXISTS item_unique_mbid_scraper_id;
+DROP INDEX IF EXISTS item_ndx_mbid;
+DROP INDEX IF EXISTS item_ndx_scraper_id;
+DROP INDEX IF EXISTS item_ndx_added;
+DROP INDEX IF EXISTS item_data_ndx_item_id;
+
+ALTER TABLE item RENAME TO item_unpartitioned;
+ALTER TABLE item_data RENAME TO item_data_unpartitioned;
+-- Keep using the same sequence for item ids
+ALTER SEQUENCE item_id_seq OWNED BY NONE;
+
+CREATE TABLE item (
+  id          INTEGER NOT NULL DEFAULT nextval('item_id_seq'),
+  mbid        UUID    NOT NULL, -- FK to recording.mbid or release_group.mbid
+  scraper_id  INTEGER NOT NULL, -- FK to scraper.id
+  added       TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+) PARTITION BY LIST (scraper_id);
+ALTER SEQUENCE item_id_seq OWNED BY item.id;
+
+CREATE TABLE item_default PARTITION OF item DEFAULT;
+
+CREATE TABLE item_data (
+  item_id     INTEGER  NOT NULL, -- FK to item.id
+  scraper_id  INTEGER  NOT NULL, -- the scraper_id of the item, FK to scraper.id
+  data        JSONB
+) PARTITION BY LIST (scraper_id);
+
+CREATE TABLE item_data_default PARTITION OF item_data DEFAULT;
+
+DO $$
+DECLARE
+  sid INTEGER;
+BEGIN
+  FOR sid IN SELECT id FROM scraper LOOP
+    EXECUTE 'CREATE TABLE item_' || sid || ' PARTITION OF item FOR VALUES IN (' || sid || ')';
+    EXECUTE 'CREATE TABLE item_data_' || sid || ' PARTITION OF item_data FOR VALUES IN (' || sid || ')';
+  END LOOP;
+END
+$$;
+
+INSERT INTO item (id, mbid, scraper_id, added)
+     SELECT id, mbid, scraper_id, added
+       FROM item_unpartitioned;
+
+INSERT INTO item_data (item_id, scraper_id, data)
+     SELECT item_data_unpartitioned.item_id, item_unpartitioned.scraper_id, item_data_unpartitioned.data
+       FROM item_data_unpartitioned
+       JOIN item_unpartitioned
+         ON item_unpartitioned.id = item_data_unpartitioned.item_id;
+
+ALTER TABLE item ADD CONSTRAINT item_pkey PRIMARY KEY (id, scraper_id);
+ALTER TABLE item_data ADD CONSTRAINT item_data_pkey PRIMARY KEY (item_id, scraper_id);
+ALTER TABLE item
+  ADD CONSTRAINT item_unique_mbid_scraper_id UNIQUE (scraper_id, mbid);
+
+ALTER TABLE item
+  ADD CONSTRAINT item_fk_scraper
+  FOREIGN KEY (scraper_id)
+    REFERENCES scraper (id);
+
+ALTER TABLE item_data
+  ADD CONSTRAINT item_data_fk_item
+  FOREIGN KEY (item_id, scraper_id)
+    REFERENCES item (id, scraper_id)
+  ON DELETE CASCADE;
+
+CREATE INDEX item_ndx_mbid ON item (mbid);
+CREATE INDEX item_ndx_added ON item (added);
+CREATE INDEX item_data_ndx_item_id ON item_data (item_id);
+
+DROP TABLE item_data_unpartitioned;
+DROP TABLE item_unpartitioned;
+
+COMMIT;
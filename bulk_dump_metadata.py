@@ -1,4 +1,7 @@
 import argparse
+import multiprocessing
+import os
+import shutil
 import sys
 import csv
 import collections
@@ -10,11 +13,137 @@ import metadb.data
 import metadb.scrapers
 import config
 
-metadb.db.init_db_engine(config.SQLALCHEMY_DATABASE_URI)
+# Number of rows read from the database and given to a parser process at once
+CHUNK_SIZE = 1000
 
+# The scraper module used by _parse_chunk in this process
+_s_obj = None
 
 
-def dump(sourcename, extradata=None, include_recordings=False):
+class RowCollector(object):
+    """Stands in for a csv writer in parse_db_data, keeping the rows so that
+    they can be returned from a parser process"""
+
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+
+class ArrowWriter(object):
+    """Writes dump rows to a Parquet or Arrow IPC file, one row group per
+    `batch_size` rows so that the whole dump is never held in memory.
+
+    Each row has an mbid and a list of tags. If `weighted` is True, dump rows
+    are [mbid, tag, weight, tag, weight, ...] and tags are stored as
+    {tag, weight} structs, otherwise rows are [mbid, tag, tag, ...]."""
+
+    def __init__(self, filename, output_format, weighted=False, batch_size=100000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("pyarrow must be installed to write {} files".format(output_format))
+        self.pa = pyarrow
+        self.weighted = weighted
+        self.batch_size = batch_size
+        self.mbids = []
+        self.tags = []
+        if weighted:
+            tag_type = pyarrow.struct([("tag", pyarrow.string()), ("weight", pyarrow.int64())])
+        else:
+            tag_type = pyarrow.string()
+        self.schema = pyarrow.schema([("mbid", pyarrow.string()), ("tags", pyarrow.list_(tag_type))])
+        if output_format == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema, compression="zstd")
+        else:
+            options = pyarrow.ipc.IpcWriteOptions(compression="zstd")
+            self.writer = pyarrow.ipc.new_file(filename, self.schema, options=options)
+
+    def writerow(self, row):
+        self.mbids.append(row[0])
+        if self.weighted:
+            self.tags.append([{"tag": t, "weight": int(w)} for t, w in zip(row[1::2], row[2::2])])
+        else:
+            self.tags.append([str(t) for t in row[1:]])
+        if len(self.mbids) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if not self.mbids:
+            return
+        table = self.pa.Table.from_arrays([self.pa.array(self.mbids, self.schema.field("mbid").type),
+                                           self.pa.array(self.tags, self.schema.field("tags").type)],
+                                          schema=self.schema)
+        self.writer.write_table(table)
+        self.mbids = []
+        self.tags = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def _init_parser(scraper, extradata):
+    global _s_obj
+    _s_obj = metadb.scrapers.create_scraper_object(scraper)
+    if extradata:
+        _s_obj.config_dump(extradata)
+
+
+def _parse_chunk(items):
+    collector = RowCollector()
+    for mbid, data in items:
+        _s_obj.parse_db_data(mbid, data, collector)
+    return collector.rows
+
+
+def parser_pool(scraper, extradata, jobs):
+    """Start `jobs` processes to parse items with, or set up this process to
+    parse them and return None if `jobs` is 1.
+    The processes are spawned rather than forked, and this must be called before
+    a database connection is opened, so that they never share its socket."""
+    if jobs == 1:
+        _init_parser(scraper, extradata)
+        return None
+    return multiprocessing.get_context("spawn").Pool(jobs, _init_parser, (scraper, extradata))
+
+
+def parse_chunks(pool, chunks, jobs):
+    """Run parse_db_data on each chunk of (mbid, data) items in a pool from
+    parser_pool with `jobs` processes.
+    Yields the rows of each chunk, in the same order as `chunks`.
+    At most 2 * jobs chunks are read ahead of the one being yielded."""
+    if pool is None:
+        for chunk in chunks:
+            yield _parse_chunk(chunk)
+        return
+
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(_parse_chunk, (chunk,)))
+        if len(pending) >= 2 * jobs:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def dump(sourcename, extradata=None, include_recordings=False, since=None, jobs=1,
+         output_format="tsv", output=None, since_id=None):
+    """Write the data of all items of a source to stdout.
+    If `since` is set, only write items which were added at or after that time.
+    If `since_id` is set, only write items with a larger id. Item ids only go
+    up, so the id returned by a previous dump is a safer mark than a time.
+    Items are parsed by `jobs` processes, and rows are written in the order
+    that they are read from the database.
+    If `output_format` is parquet or arrow, rows are written to the file `output`
+    instead (see ArrowWriter).
+    Returns the largest id of the written items, or None if no items were written"""
     source = metadb.data.load_source(sourcename)
     scraper = metadb.data.load_latest_scraper_for_source(source)
     if scraper["mb_type"] == "release_group" and include_recordings:
@@ -27,45 +156,132 @@ def dump(sourcename, extradata=None, include_recordings=False):
     if extradata and not hasattr(s_obj, "config_dump"):
         raise Exception("You specified extra data, but module for parser {} doesn't have a .config_dump method to load it".format(sourcename))
 
-    if extradata:
-        s_obj.config_dump(extradata)
-
-    query = text("""
+    if include_recordings:
+        # The recordings of each release group are aggregated by the database,
+        # so that we never need the whole recording_release_group table in memory
+        query = """
+      SELECT COALESCE(recordings.mbids, '{}')
+           , data
+           , item.id
+        FROM item
+        JOIN item_data
+          ON item_data.item_id = item.id
+         AND item_data.scraper_id = item.scraper_id
+        JOIN item_data_blob
+          ON item_data_blob.hash = item_data.data_hash
+   LEFT JOIN LATERAL (SELECT array_agg(recording_mbid::text ORDER BY recording_mbid) AS mbids
+                        FROM recording_release_group
+                       WHERE recording_release_group.release_group_mbid = item.mbid) recordings
+          ON true
+       WHERE item.scraper_id = :id"""
+    else:
+        query = """
       SELECT mbid::text
            , data
+           , item.id
         FROM item
         JOIN item_data
-          ON item_id = item.id
-       WHERE scraper_id = :id""")
+          ON item_data.item_id = item.id
+         AND item_data.scraper_id = item.scraper_id
+        JOIN item_data_blob
+          ON item_data_blob.hash = item_data.data_hash
+       WHERE item.scraper_id = :id"""
+    if since:
+        query += """
+         AND item.added >= CAST(:since AS TIMESTAMP WITH TIME ZONE)"""
+    if since_id:
+        query += """
+         AND item.id > :since_id"""
+    if include_recordings:
+        query += """
+    ORDER BY item.mbid"""
+    query = text(query)
 
-    recording_rg_query = text("""
-      SELECT recording_mbid::text
-           , release_group_mbid::text
-        FROM recording_release_group""")
-
-    with metadb.db.engine.begin() as connection:
+    if output_format == "tsv":
         w = csv.writer(sys.stdout, delimiter="\t")
-        release_group_recordings = collections.defaultdict(list)
-        if include_recordings:
-            res = connection.execute(recording_rg_query)
-            for rec, rg in res.fetchall():
-                release_group_recordings[rg].append(rec)
-
-        res = connection.execute(query, {"id": scraper["id"]})
-        for row in res.fetchall():
-            mbid, data = row
-            if include_recordings:
-                recording_mbids = release_group_recordings.get(mbid, [])
-                # TODO: Now this param could be a list or a value. Adding another parameter makes recording scrapers weird
-                # todo: what about having 2 methods? one for recording data and one for releases?
-                mbid = recording_mbids
-            s_obj.parse_db_data(mbid, data, w)
+    else:
+        w = ArrowWriter(output, output_format, getattr(s_obj, "DUMP_TAG_WEIGHTS", False))
+
+    newest = None
+    pool = parser_pool(scraper, extradata, jobs)
+    try:
+        with metadb.db.engine.begin() as connection:
+
+            def chunks():
+                nonlocal newest
+                # A server-side cursor, so that only CHUNK_SIZE rows are in memory at once
+                res = connection.execution_options(stream_results=True).execute(
+                    query, {"id": scraper["id"], "since": since, "since_id": since_id})
+                while True:
+                    rows = res.fetchmany(CHUNK_SIZE)
+                    if not rows:
+                        break
+                    items = []
+                    # With include_recordings, mbid is the list of recordings in the release group
+                    # TODO: Now this param could be a list or a value. Adding another parameter makes recording scrapers weird
+                    # todo: what about having 2 methods? one for recording data and one for releases?
+                    for mbid, data, item_id in rows:
+                        if newest is None or item_id > newest:
+                            newest = item_id
+                        items.append((mbid, data))
+                    yield items
+
+            for rows in parse_chunks(pool, chunks(), jobs):
+                w.writerows(rows)
+    finally:
+        if pool:
+            pool.terminate()
+    if output_format != "tsv":
+        w.close()
+    return newest
+
+
+def read_since_state(filename):
+    """Read the item id saved by write_since_state, or None if there is no state yet"""
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as fp:
+        value = fp.read().strip()
+    return int(value) if value else None
+
+
+def write_since_state(filename, item_id):
+    # Write to a new file and rename it so that a failed write leaves the old state
+    tmpname = filename + ".tmp"
+    with open(tmpname, "w") as fp:
+        fp.write("%d\n" % item_id)
+    os.replace(tmpname, filename)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--recording", action="store_true", help="If the source is a release, dump data for all recordings in each release", required=False)
     parser.add_argument("--data", help="Additional data file if required by scraper (e.g. genre tree)", required=False)
+    parser.add_argument("--since", help="Only dump items added at or after this time (e.g. 2019-01-31T12:00:00+00:00)", required=False)
+    parser.add_argument("--since-state", help="File with the largest item id of the previous dump. "
+                        "Only newer items are dumped, and the file is updated after the dump succeeds", required=False)
+    parser.add_argument("--merge", help="Output of a previous dump to write before the new items, "
+                        "so that the output contains all items", required=False)
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes to parse items with", required=False)
+    parser.add_argument("--format", choices=["tsv", "parquet", "arrow"], default="tsv",
+                        help="Output format. parquet and arrow need pyarrow and --output", required=False)
+    parser.add_argument("--output", "-o", help="File to write parquet or arrow output to", required=False)
     parser.add_argument("source")
     args = parser.parse_args()
-    dump(args.source, args.data, args.recording)
+    if args.format != "tsv":
+        if not args.output:
+            parser.error("--output is required for --format {}".format(args.format))
+        if args.merge:
+            parser.error("--merge only works with --format tsv")
+
+    metadb.db.init_db_engine(config.SQLALCHEMY_DATABASE_URI)
+    since_id = None
+    if args.since_state:
+        since_id = read_since_state(args.since_state)
+    if args.merge:
+        with open(args.merge) as fp:
+            shutil.copyfileobj(fp, sys.stdout)
+    newest = dump(args.source, args.data, args.recording, args.since, args.jobs, args.format, args.output, since_id)
+    sys.stdout.flush()
+    if args.since_state and newest:
+        write_since_state(args.since_state, newest)
@@ -4,17 +4,21 @@ get_unprocessed: Get mbids and metadata that have not been looked up\
                  for a particular source
 
 Usage:
-    bulk_get_unprocessed.py --source lastfm --outname x [-n n|-p p]
+    bulk_get_unprocessed.py --source lastfm --outname x [-n n|-p p] [--shards k] [--compress gzip|zstd]
 
-use -n to write n rows per file
-use -p to write exactly p files
+use -n to write n files
+use -p to write p rows per file
 omit to write one file
+use --shards to split the mbids into k ranges which are dumped in parallel,
+  each into its own file (or files of p rows with -p)
+use --compress to compress the files
 
 """
 
 import argparse
 import csv
-import math
+import itertools
+import multiprocessing
 
 import metadb.data
 import metadb.db
@@ -24,53 +28,118 @@ import config
 
 metadb.db.init_db_engine(config.SQLALCHEMY_DATABASE_URI)
 
+EXTENSIONS = {None: ".csv", "gzip": ".csv.gz", "zstd": ".csv.zst"}
+
 
 def dump_items(filename, data, keys):
-    with open(filename, "w") as fp:
+    """Write rows to `filename` and return the number of rows written"""
+    count = 0
+    with metadb.util.open_file(filename, "wt") as fp:
         dw = csv.DictWriter(fp, keys)
         dw.writeheader()
-        dw.writerows(data)
-
-
-def main(source_name, outname, perfile=None, numfiles=None):
-    source = metadb.data.load_source(source_name)
-    scraper = metadb.data.load_latest_scraper_for_source(source)
+        for row in data:
+            dw.writerow(row)
+            count += 1
+    return count
+
+
+def dump_items_into_files(filenames, data, keys):
+    """Write rows round-robin into each of `filenames` so that
+    every file gets the same number of rows (+/- 1).
+    Returns the number of rows written"""
+    count = 0
+    fps = [metadb.util.open_file(f, "wt") for f in filenames]
+    try:
+        writers = [csv.DictWriter(fp, keys) for fp in fps]
+        for dw in writers:
+            dw.writeheader()
+        for dw, row in zip(itertools.cycle(writers), data):
+            dw.writerow(row)
+            count += 1
+    finally:
+        for fp in fps:
+            fp.close()
+    return count
+
+
+def dump_items_per_file(outname, extension, data, keys, perfile):
+    """Write rows into files of `perfile` rows, starting a new file when one is full.
+    Rows are streamed, so only one row is in memory at a time.
+    Returns the number of rows written"""
+    data = iter(data)
+    count = 0
+    for i in itertools.count(1):
+        try:
+            first = next(data)
+        except StopIteration:
+            break
+        filename = "%s-%d%s" % (outname, i, extension)
+        count += dump_items(filename, itertools.chain([first], itertools.islice(data, perfile - 1)), keys)
+    return count
+
+
+def get_unprocessed(scraper, mbid_range=None):
     if scraper["mb_type"] == "recording":
-        metadb.log.info("Dumping recording items")
         keys = ["mbid", "name", "artist_credit"]
-        data = metadb.data.get_unprocessed_recordings_for_scraper(scraper)
+        data = metadb.data.iter_unprocessed_recordings_for_scraper(scraper, mbid_range=mbid_range)
     elif scraper["mb_type"] == "release_group":
-        metadb.log.info("Dumping release_group items")
         keys = ["mbid", "name", "artist_credit", "first_release_date"]
-        data = metadb.data.get_unprocessed_release_groups_for_scraper(scraper)
+        data = metadb.data.iter_unprocessed_release_groups_for_scraper(scraper, mbid_range=mbid_range)
+    return keys, data
 
-    datalen = len(data)
-    metadb.log.info("Got {} items".format(datalen))
 
+def dump_shard(scraper, mbid_range, outname, extension, perfile):
+    """Dump the unprocessed items in one range of mbids. Runs in its own process,
+    and so uses its own database connection"""
+    keys, data = get_unprocessed(scraper, mbid_range)
+    if perfile:
+        return dump_items_per_file(outname, extension, data, keys, perfile)
+    else:
+        return dump_items(outname + extension, data, keys)
+
+
+def main(source_name, outname, perfile=None, numfiles=None, shards=None, compress=None):
+    source = metadb.data.load_source(source_name)
+    scraper = metadb.data.load_latest_scraper_for_source(source)
+    metadb.log.info("Dumping {} items".format(scraper["mb_type"]))
+    extension = EXTENSIONS[compress]
+
+    if shards:
+        metadb.log.info("Dumping {} ranges of mbids in parallel".format(shards))
+        args = [(scraper, r, "%s-shard%d" % (outname, i), extension, perfile)
+                for i, r in enumerate(metadb.util.uuid_ranges(shards), 1)]
+        with multiprocessing.Pool(shards) as pool:
+            counts = pool.starmap(dump_shard, args)
+        for i, count in enumerate(counts, 1):
+            metadb.log.info("Shard {}: {} items".format(i, count))
+        return
+
+    keys, data = get_unprocessed(scraper)
     if numfiles:
-        perfile = math.ceil(datalen/numfiles)
-        metadb.log.info("Dumping into {} files of {} each".format(numfiles, perfile))
+        metadb.log.info("Dumping into {} files".format(numfiles))
+        filenames = ["%s-%d%s" % (outname, i, extension) for i in range(1, numfiles + 1)]
+        count = dump_items_into_files(filenames, data, keys)
     elif perfile:
         metadb.log.info("Dumping into files of {} each".format(perfile))
-
-    if perfile:
-        for i, chunk in enumerate(metadb.util.chunks(data, perfile), 1):
-            filename = "%s-%d.csv" % (outname, i)
-            dump_items(filename, chunk, keys)
+        count = dump_items_per_file(outname, extension, data, keys, perfile)
     else:
-        filename = "%s.csv" % (outname,)
-        dump_items(filename, data, keys)
+        count = dump_items(outname + extension, data, keys)
+    metadb.log.info("Got {} items".format(count))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Dump unprocessed items")
     parser.add_argument("--source", help="source name", required=True)
     parser.add_argument("--outname", help="Filename template to write to (no extension)", required=True)
+    parser.add_argument("--shards", type=int, help="Number of mbid ranges to dump in parallel")
+    parser.add_argument("--compress", choices=["gzip", "zstd"], help="Compress the output files")
 
-    group = parser.add_mutually_exclusive_group(required=True)
+    group = parser.add_mutually_exclusive_group()
     group.add_argument("-p", type=int, help="Number of items to dump per file")
     group.add_argument("-n", type=int, help="Number of files to dump")
 
 
     args = parser.parse_args()
-    main(args.source, args.outname, args.p, args.n)
+    if args.shards and args.n:
+        parser.error("-n can't be used with --shards, each shard is written to its own file")
+    main(args.source, args.outname, args.p, args.n, args.shards, args.compress)
@@ -6,7 +6,8 @@ Usage:
     bulk_load.py lastfm metadb.scrapers.recording.lastfm/
 
 first argument is the name of the source
-second argument is the directory created by bulk_lookup
+second argument is the directory created by bulk_lookup, with a file
+per item, JSONL segments (bulk_lookup.py --store segments), or both
 
 """
 
@@ -18,20 +19,25 @@ import json
 
 from metadb import util
 from metadb import log
+from metadb import segments
 
 import metadb.db
 import config
 import metadb.data
 
+def _read_items(filenames):
+    for fname in filenames:
+        try:
+            with open(fname) as fp:
+                data = json.load(fp)
+            mbid = os.path.splitext(os.path.basename(fname))[0]
+            yield mbid, data
+        except ValueError:
+            log.warn("{}: not valid json".format(fname))
+
+
 def bulk_import_some_items(scraper, filenames):
-    with metadb.db.engine.begin() as connection:
-        for fname in filenames:
-            try:
-                data = json.load(open(fname))
-                mbid = os.path.splitext(os.path.basename(fname))[0]
-                metadb.data._add_item_w_connection(connection, scraper, mbid, data=data)
-            except ValueError:
-                log.warn("{}: not valid json".format(fname))
+    return metadb.data.add_items_bulk(scraper, _read_items(filenames))
 
 
 def load(sourcename, thedir):
@@ -50,23 +56,59 @@ def load(sourcename, thedir):
         log.warn("{}: not a directory".format(thedir))
         sys.exit(1)
 
+    # A directory can have both kinds if bulk_lookup was run with a different --store
     allfiles = []
     for root, dirs, files in os.walk(thedir):
         for fname in files:
-            allfiles.append(os.path.join(root, fname))
+            if fname.endswith(".json"):
+                allfiles.append(os.path.join(root, fname))
+    is_segment_store = segments.is_segment_store(thedir)
+    if allfiles or not is_segment_store:
+        load_files(scraper, allfiles)
+    if is_segment_store:
+        load_segments(scraper, thedir)
+
 
+def load_files(scraper, allfiles):
+    """Load items from a file for each item"""
     total = len(allfiles)
     log.info("Got {} items to add.".format(total))
 
     done = 0
+    inserted = 0
+    skipped = 0
     starttime = time.monotonic()
-    SIZE = 1000
+    SIZE = 10000
     for fnames in util.chunks(allfiles, SIZE):
-        bulk_import_some_items(scraper, fnames)
+        counts = bulk_import_some_items(scraper, fnames)
+        inserted += counts["inserted"]
+        skipped += counts["skipped"]
+
+        done += len(fnames)
+        durdelta, remdelta = util.stats(done, total, starttime)
+        log.info("Done %s/%s in %s; %s remaining", done, total, str(durdelta), str(remdelta))
+    log.info("Inserted %s items, skipped %s existing items", inserted, skipped)
+
+
+def load_segments(scraper, thedir):
+    """Load items from a segment store, reading the segments in order"""
+    total = segments.count_items(thedir)
+    log.info("Got {} items to add.".format(total))
+
+    done = 0
+    inserted = 0
+    skipped = 0
+    starttime = time.monotonic()
+    SIZE = 10000
+    for items in util.chunks_iter(segments.read_items(thedir), SIZE):
+        counts = metadb.data.add_items_bulk(scraper, items)
+        inserted += counts["inserted"]
+        skipped += counts["skipped"]
 
-        done += SIZE
+        done += len(items)
         durdelta, remdelta = util.stats(done, total, starttime)
         log.info("Done %s/%s in %s; %s remaining", done, total, str(durdelta), str(remdelta))
+    log.info("Inserted %s items, skipped %s existing items", inserted, skipped)
 
 
 def main():
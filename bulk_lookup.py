@@ -5,11 +5,33 @@ Lookup: Look up metadata on remote sites
 Usage:
     bulk_lookup.py --module metadb.scrapers.recording.lastfm --csv datafile.csv --save
 
-The argument to --csv is the result of `bulk_get_unprocessed.py`
+The argument to --csv is the result of `bulk_get_unprocessed.py`,
+which can be compressed with gzip (.csv.gz) or zstd (.csv.zst)
 
 Specify --save to save results to file, otherwise results will
 be printed to stdout.
 Results will be saved to a directory named the same as the module name.
+By default each result is saved in its own file. With --store segments,
+results are appended to JSONL segment files instead (see metadb.segments),
+optionally compressed with --compress. bulk_load.py can read either.
+
+Lookups are limited to the RATE_LIMIT (requests per second) and RATE_BURST
+of the scraper module, or --rate and --burst if given.
+Use -n to set the number of lookups which can run at once.
+
+Lookups which fail with a temporary error (a timeout, connection error,
+5xx response, or an error which the module's is_retryable says is temporary)
+are tried again --retries times, waiting longer after each attempt.
+Lookups which still fail with a temporary error are written to a csv file
+(--failures, by default <csv name>.failed.csv) which can be used as the --csv
+of another run. Permanent failures (e.g. no match) are only logged, so that
+they aren't tried again.
+
+Use --async to run lookups on an asyncio event loop with aiohttp, which can
+keep thousands of lookups running at once (e.g. -n 2000 against a local
+mirror). Modules with a scrape_async(query, session) method use it, and
+other modules run .scrape in a pool of threads. --per-host limits the
+number of connections to each host.
 
 """
 from argparse import ArgumentParser
@@ -19,11 +41,38 @@ import csv
 import json
 import os.path
 import time
+import uuid
 import random
+import asyncio
+import threading
 import concurrent.futures
 
+import requests
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
 from metadb import util
 from metadb import log
+from metadb import ratelimit
+from metadb import segments
+
+# Rate limit for modules which don't set RATE_LIMIT, in requests per second
+DEFAULT_RATE_LIMIT = 1
+
+# Seconds between progress messages
+LOG_INTERVAL = 10
+
+# Number of times to try a lookup again after a temporary error
+MAX_RETRIES = 4
+# Seconds to wait before the first retry. Each retry waits up to twice as long
+# as the last one, with random jitter so that workers don't retry together
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 60
+
+# Most threads to run .scrape with in --async mode, for modules without scrape_async
+MAX_ASYNC_THREADS = 64
 
 
 def _get_module_by_path(modulepath):
@@ -41,55 +90,237 @@ def save(result, outfile):
         json.dump(result, f)
 
 
-def process_items(items, module, save, numworkers):
-    allprocessed = True
-    with concurrent.futures.ThreadPoolExecutor(max_workers=numworkers) as executor:
-        future_to_row = {}
-
-        for i in items:
-            if 'module' not in i:
-                i['module'] = module
-            if 'save' not in i:
-                i['save'] = save
-
-            future_to_row[executor.submit(process, i)] = i
+def get_rate_limiter(modulepath, rate=None, burst=None):
+    """Make a rate limiter for a scraper module, using its RATE_LIMIT and
+    RATE_BURST unless `rate` or `burst` are given"""
+    module = _get_module_by_path(modulepath)
+    if rate is None:
+        rate = getattr(module, "RATE_LIMIT", DEFAULT_RATE_LIMIT)
+    if burst is None:
+        burst = getattr(module, "RATE_BURST", 1)
+    return ratelimit.TokenBucket(rate, burst)
+
+
+class FailureJournal(object):
+    """A csv file of queries which could not be looked up because of a
+    temporary error, with the same columns as the input file and an extra
+    error column"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = 0
+        self._fp = None
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def record(self, query, error):
+        row = {k: v for k, v in query.items() if k not in ('module', 'save', 'error')}
+        row['error'] = str(error)
+        with self._lock:
+            if not self._writer:
+                self._fp = open(self.filename, "w", newline="")
+                self._writer = csv.DictWriter(self._fp, list(row.keys()), extrasaction='ignore')
+                self._writer.writeheader()
+            self._writer.writerow(row)
+            self._fp.flush()
+            self.count += 1
+
+    def close(self):
+        if self._fp:
+            self._fp.close()
+
+
+def failures_filename(filename):
+    """The default failure journal for an input file, e.g. items.csv.gz -> items.failed.csv"""
+    base = os.path.basename(filename)
+    if ".csv" in base:
+        base = base[:base.index(".csv")]
+    return os.path.join(os.path.dirname(filename), base + ".failed.csv")
+
+
+def is_retryable(exc, module):
+    """True if a lookup which raised `exc` could work if it is tried again"""
+    if hasattr(module, "is_retryable"):
+        retryable = module.is_retryable(exc)
+        if retryable is not None:
+            return retryable
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    # aiohttp.ClientResponseError
+    status = getattr(exc, "status", None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    if aiohttp and isinstance(exc, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+        return True
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout,
+                            asyncio.TimeoutError, ConnectionError, TimeoutError))
 
-        for future in concurrent.futures.as_completed(future_to_row):
-            i = future_to_row[future]
-            try:
-                result = future.result()
-                allprocessed = allprocessed and result
-            except Exception as exc:
-                raise
-                print('%r generated an exception: %s' % (i, exc))
 
-    return not allprocessed
+def _retry_delay(attempt):
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
 
-def process_file(module, filename, numworkers, save=False):
-    data = []
-    with open(filename) as csvfile:
-        for query in csv.DictReader(csvfile):
-            data.append(query)
 
-    total = len(data)
+def _mbid_key(mbid):
+    """A compact key for an mbid in the set of saved mbids"""
+    try:
+        return uuid.UUID(mbid).bytes
+    except ValueError:
+        return mbid
+
+
+def find_saved_mbids(module):
+    """Scan the output directory of a module once and return a set of
+    the keys (see _mbid_key) of the mbids which are already saved"""
+    saved = set()
+    if not os.path.isdir(module):
+        return saved
+    for subdir in os.scandir(module):
+        if subdir.is_dir():
+            for f in os.scandir(subdir.path):
+                if f.name.endswith(".json"):
+                    saved.add(_mbid_key(f.name[:-len(".json")]))
+    for mbid in segments.read_mbids(module):
+        saved.add(_mbid_key(mbid))
+    return saved
+
+
+class QueryReader(object):
+    """Reads queries from a csv file one at a time, so that the file is never
+    all in memory. The file may be compressed (see util.open_file).
+    With `save`, queries for items which are already saved are skipped."""
+
+    def __init__(self, filename, module, save):
+        self.filename = filename
+        self.module = module
+        self.save = save
+        self.skipped = 0
+        self.saved = set()
+        self._rawfile = None
+
+    def __iter__(self):
+        if self.save:
+            # Instead of checking if each item's file exists while processing
+            self.saved = find_saved_mbids(self.module)
+            log.info("Found %s items which are already saved", len(self.saved))
+        with open(self.filename, "rb") as self._rawfile:
+            with util.open_file(self.filename, "rt", self._rawfile) as csvfile:
+                for query in csv.DictReader(csvfile):
+                    if self.saved and _mbid_key(query['mbid']) in self.saved:
+                        self.skipped += 1
+                        continue
+                    if 'module' not in query:
+                        query['module'] = self.module
+                    if 'save' not in query:
+                        query['save'] = self.save
+                    yield query
+
+    def progress(self):
+        """The position in the (compressed) file and its size, in bytes"""
+        if not self._rawfile or self._rawfile.closed:
+            return 1, 1
+        return self._rawfile.tell(), os.fstat(self._rawfile.fileno()).st_size
+
+
+def _log_progress(done, reader, starttime):
+    position, size = reader.progress()
+    if position:
+        durdelta, remdelta = util.stats(position, size, starttime)
+        log.info("Done %s items (%s%% of file) in %s; %s remaining", done, round(100 * position / size),
+                 str(durdelta), str(remdelta))
+
+
+def process_file(module, filename, numworkers, save=False, rate=None, burst=None,
+                 retries=MAX_RETRIES, failures=None, store=None):
+    reader = QueryReader(filename, module, save)
+    journal = FailureJournal(failures or failures_filename(filename))
     starttime = time.monotonic()
+    lastlog = starttime
     done = 0
-    CHUNK_SIZE = 1
+    limiter = get_rate_limiter(module, rate, burst)
 
-    for items in util.chunks(data, CHUNK_SIZE):
-        skipped = process_items(items, module, save, numworkers)
-        done += CHUNK_SIZE
-        durdelta, remdelta = util.stats(done, total, starttime)
-        if not skipped:
-            time.sleep(random.uniform(.5, 1.5))
-        log.info("Done %s/%s in %s; %s remaining", done, total, str(durdelta), str(remdelta))
+    # One pool for the whole file. Up to 2 * numworkers items are queued so that
+    # a worker never waits for the next item, and the limiter decides how fast they run.
+    # Queries are only read from the file when there's space in the queue
+    with concurrent.futures.ThreadPoolExecutor(max_workers=numworkers) as executor:
+        pending = set()
+        for query in reader:
+            pending.add(executor.submit(process, query, limiter, False, retries, journal, store))
+
+            if len(pending) >= numworkers * 2:
+                finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                done += len(finished)
+                if time.monotonic() - lastlog > LOG_INTERVAL:
+                    lastlog = time.monotonic()
+                    _log_progress(done, reader, starttime)
+
+        for future in concurrent.futures.as_completed(pending):
+            future.result()
+            done += 1
+    journal.close()
+    log.info("Done %s items in %s seconds, skipped %s items which were already saved",
+             done, round(time.monotonic() - starttime), reader.skipped)
+    if journal.count:
+        log.warn("%s items failed, see %s", journal.count, journal.filename)
+
+
+def process_file_async(module, filename, concurrency, save=False, rate=None, burst=None, per_host=None,
+                       retries=MAX_RETRIES, failures=None, store=None):
+    """Like process_file, but with up to `concurrency` lookups at once on an event loop"""
+    if not aiohttp:
+        raise Exception("aiohttp must be installed to use --async")
+    reader = QueryReader(filename, module, save)
+    journal = FailureJournal(failures or failures_filename(filename))
+    limiter = get_rate_limiter(module, rate, burst)
+    starttime = time.monotonic()
+    done = 0
 
+    async def run():
+        connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host or 0)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(concurrency, MAX_ASYNC_THREADS))
+        semaphore = asyncio.Semaphore(concurrency)
+        lastlog = starttime
 
-def process(query):
-    """Process a single item.
-    Returns True if an item was successfully looked up and written to file
-    Returns False if the file for this item already exists.
-    """
+        async def process_one(query):
+            nonlocal done, lastlog
+            try:
+                await process_async(query, session, executor, limiter, False, retries, journal, store)
+            finally:
+                semaphore.release()
+            done += 1
+            if time.monotonic() - lastlog > LOG_INTERVAL:
+                lastlog = time.monotonic()
+                _log_progress(done, reader, starttime)
+
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = set()
+            # The semaphore stops more than `concurrency` queries being read from the file at once
+            for query in reader:
+                await semaphore.acquire()
+                tasks.add(asyncio.create_task(process_one(query)))
+                # Check finished tasks now and then, so that errors stop the run early
+                if len(tasks) >= concurrency * 2:
+                    finished = {t for t in tasks if t.done()}
+                    for t in finished:
+                        t.result()
+                    tasks -= finished
+            if tasks:
+                await asyncio.gather(*tasks)
+        executor.shutdown()
+
+    asyncio.run(run())
+    journal.close()
+    log.info("Done %s items in %s seconds, skipped %s items which were already saved",
+             done, round(time.monotonic() - starttime), reader.skipped)
+    if journal.count:
+        log.warn("%s items failed, see %s", journal.count, journal.filename)
+
+
+def _prepare(query):
+    """Check a query and get its scraper module.
+    Returns (module, outfile), where outfile is the file to save the result to,
+    or None if the result isn't being saved"""
 
     if not 'module' in query or not query['module']:
         raise Exception("Missing module information for the query", json.dumps(query))
@@ -102,25 +333,94 @@ def process(query):
     if not query['mbid']:
         raise Exception("Missing MBID for the query", json.dumps(query))
 
+    outfile = None
     if query['save']:
-        # Check if result file already exists
         mbid = query['mbid']
         outfile = os.path.join(query['module'], mbid[:2], "{}.json".format(mbid))
-        if os.path.exists(outfile):
-            return False
+    return module, outfile
 
-    try:
-        result = module.scrape(query)
-    except Exception as e:
-        print(str(e))
-        return True
 
-    if query['save']:
+def _write_result(result, query, outfile, store):
+    if store and query['save']:
+        store.write(query['mbid'], result)
+    elif outfile:
         save(result, outfile)
     else:
         print(json.dumps(result, indent=2))
 
-    return True
+
+def _lookup_failed(query, module, exc, attempt, retries, journal):
+    """Decide what to do after a lookup raised `exc`.
+    Returns the number of seconds to wait before trying again, or None
+    if the lookup has failed for good. Lookups which ran out of retries are
+    written to `journal` to be tried in a later run"""
+    retryable = is_retryable(exc, module)
+    if attempt < retries and retryable:
+        delay = _retry_delay(attempt)
+        log.info("%s: %s, trying again in %.1f seconds", query['mbid'], exc, delay)
+        return delay
+    log.warn("%s: %s", query['mbid'], exc)
+    if journal and retryable:
+        journal.record(query, exc)
+    return None
+
+
+def process(query, limiter=None, check_saved=True, retries=0, journal=None, store=None):
+    """Process a single item.
+    If `limiter` is set, wait for it before looking up the item.
+    If `check_saved` is False, the caller has already checked that the item
+    isn't saved (see find_saved_mbids).
+    Temporary errors are tried again up to `retries` times. Items which
+    still fail are written to `journal`, a FailureJournal.
+    If `store` is a segments.SegmentWriter, saved results are written to it
+    instead of to their own file.
+    Returns True if an item was successfully looked up and written to file
+    Returns False if the file for this item already exists.
+    """
+    module, outfile = _prepare(query)
+    # Check if result file already exists
+    if check_saved and outfile and os.path.exists(outfile):
+        return False
+
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            result = module.scrape(query)
+        except Exception as e:
+            delay = _lookup_failed(query, module, e, attempt, retries, journal)
+            if delay is None:
+                return True
+            time.sleep(delay)
+        else:
+            _write_result(result, query, outfile, store)
+            return True
+
+
+async def process_async(query, session, executor, limiter=None, check_saved=True, retries=0, journal=None,
+                        store=None):
+    """Like process, but uses the module's scrape_async with the aiohttp
+    `session` if it has one, otherwise runs .scrape in `executor`"""
+    module, outfile = _prepare(query)
+    if check_saved and outfile and os.path.exists(outfile):
+        return False
+
+    for attempt in range(retries + 1):
+        if limiter:
+            await limiter.acquire_async()
+        try:
+            if hasattr(module, "scrape_async"):
+                result = await module.scrape_async(query, session)
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(executor, module.scrape, query)
+        except Exception as e:
+            delay = _lookup_failed(query, module, e, attempt, retries, journal)
+            if delay is None:
+                return True
+            await asyncio.sleep(delay)
+        else:
+            _write_result(result, query, outfile, store)
+            return True
 
 
 if __name__ == "__main__":
@@ -134,13 +434,34 @@ if __name__ == "__main__":
     parser.add_argument('--mbid', help='Associated (artist/recording/release) MBID to store data for', required=False)
     parser.add_argument('--save', help="Save to file", action='store_true', default=False)
     parser.add_argument('-n', help="Number of workers", type=int, default=1)
+    parser.add_argument('--rate', help="Maximum requests per second, instead of the module's RATE_LIMIT", type=float, required=False)
+    parser.add_argument('--burst', help="Maximum requests at once after a pause, instead of the module's RATE_BURST", type=int, required=False)
+    parser.add_argument('--async', dest='use_async', help="Run lookups on an asyncio event loop", action='store_true', default=False)
+    parser.add_argument('--per-host', help="Maximum connections to each host with --async", type=int, required=False)
+    parser.add_argument('--retries', help="Number of times to try again after a temporary error", type=int, default=MAX_RETRIES)
+    parser.add_argument('--failures', help="File to write queries which failed with a temporary error to (default <csv name>.failed.csv)", required=False)
+    parser.add_argument('--store', help="How to save results: a file per item, or JSONL segments", choices=['files', 'segments'], default='files')
+    parser.add_argument('--compress', help="Compress segments with --store segments", choices=['gzip', 'zstd'], required=False)
+    parser.add_argument('--segment-size', help="Number of items in each segment", type=int, default=100000)
 
     args = parser.parse_args()
 
     if args.csv:
         if args.artist or args.recording or args.release or args.mbid:
             print('Performing queries using data in ', args.csv, ' file; --artist/--recording/--release/--mbid flags will be ignored')
-        process_file(args.module, args.csv, args.n, args.save)
+        store = None
+        if args.save and args.store == 'segments':
+            store = segments.SegmentWriter(args.module, args.segment_size, args.compress)
+        try:
+            if args.use_async:
+                process_file_async(args.module, args.csv, args.n, args.save, args.rate, args.burst, args.per_host,
+                                   args.retries, args.failures, store)
+            else:
+                process_file(args.module, args.csv, args.n, args.save, args.rate, args.burst,
+                             args.retries, args.failures, store)
+        finally:
+            if store:
+                store.close()
 
     else:
         process(args.__dict__)
@@ -23,6 +23,16 @@ SQLALCHEMY_DATABASE_URI = os.getenv("METADB_DB_URI")
 # Database for testing
 SQLALCHEMY_TEST_URI = os.getenv("METADB_TEST_DB_URI")
 
+# Connection pool for the webserver and celery workers, one per process
+SQLALCHEMY_POOL_SIZE = int(os.getenv("METADB_DB_POOL_SIZE", 5))
+SQLALCHEMY_MAX_OVERFLOW = int(os.getenv("METADB_DB_MAX_OVERFLOW", 10))
+# Seconds after which a connection is replaced, -1 to never replace
+SQLALCHEMY_POOL_RECYCLE = int(os.getenv("METADB_DB_POOL_RECYCLE", 3600))
+SQLALCHEMY_POOL_PRE_PING = os.getenv("METADB_DB_POOL_PRE_PING", "True") == "True"
+
+# Seconds to keep the list of sources and scrapers in memory before reloading it
+REGISTRY_REFRESH_INTERVAL = int(os.getenv("METADB_REGISTRY_REFRESH_INTERVAL", 300))
+
 # LOGGING
 
 LOG_FILE_ENABLED = False
@@ -52,8 +52,9 @@ def init_db(force):
     db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_types.sql'))
     db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_tables.sql'))
 
-    print('Creating primary and foreign keys...')
+    print('Creating primary and foreign keys and constraints...')
     db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_primary_keys.sql'))
+    db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_constraints.sql'))
     db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_foreign_keys.sql'))
 
     print('Creating indexes...')
@@ -89,11 +90,64 @@ def init_test_db(force=False):
     db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_types.sql'))
     db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_tables.sql'))
     db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_primary_keys.sql'))
+    db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_constraints.sql'))
     db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_foreign_keys.sql'))
     db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_indexes.sql'))
 
     print("Done!")
 
+@cli.command()
+def partition_items():
+    """Move item and item_data into tables which are partitioned by scraper.
+
+    For databases which were created before item was partitioned.
+    This copies every item, so it needs as much free disk space as the two tables.
+    """
+    db.init_db_engine(config.SQLALCHEMY_DATABASE_URI)
+
+    print('Partitioning item and item_data...')
+    db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'updates', 'partition_item.sql'))
+    print("Done!")
+
+
+@cli.command()
+def deduplicate_item_data():
+    """Store each distinct item_data payload only once.
+
+    For databases which were created before item_data_blob was added.
+    """
+    db.init_db_engine(config.SQLALCHEMY_DATABASE_URI)
+
+    print('Moving item_data payloads to item_data_blob...')
+    db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'updates', 'deduplicate_item_data.sql'))
+    print("Done! Run VACUUM FULL item_data to reclaim disk space.")
+
+
+def _load_scraper(source_name):
+    """The latest scraper of a source. Exits if there is no such source or scraper"""
+    source = data.load_source(source_name)
+    if not source:
+        print("No source with the name %s" % source_name)
+        sys.exit(1)
+    scraper = data.load_latest_scraper_for_source(source)
+    if not scraper:
+        print("No scraper for the source %s" % source_name)
+        sys.exit(1)
+    return scraper
+
+
+@cli.command()
+@click.option("--source", "-s", required=True, help="Source name")
+def index_tags(source):
+    """Add the tags of existing items of a source to item_tag."""
+    db.init_db_engine(config.SQLALCHEMY_DATABASE_URI)
+
+    scraper = _load_scraper(source)
+    print("Indexing tags...")
+    tagged = data.index_item_tags(scraper)
+    print("Done! Added tags for %s items" % tagged)
+
+
 @cli.command()
 def fixtures():
     db.init_db_engine(config.SQLALCHEMY_DATABASE_URI)
@@ -139,5 +193,33 @@ def lstokens():
     for t in tokens:
         print("%s admin=%s" % (t["token"], t["admin"]))
 
+@cli.command()
+@click.option("--source", "-s", required=True, help="Source name")
+@click.option("--mbid", "-m", multiple=True, help="Add only this mbid, instead of all unprocessed items")
+def enqueue_scrape(source, mbid):
+    """Add items to the scrape queue of a source."""
+    db.init_db_engine(config.SQLALCHEMY_DATABASE_URI)
+
+    scraper = _load_scraper(source)
+    if mbid:
+        added = data.enqueue_scrape(scraper, mbid)
+    else:
+        added = data.enqueue_unprocessed_scrape(scraper)
+    print("Added %s items to the queue" % added)
+
+
+@cli.command()
+@click.option("--source", "-s", required=True, help="Source name")
+@click.option("--concurrency", "-c", default=8, show_default=True, help="Number of items to scrape at once")
+@click.option("--batch-size", "-b", type=int, help="Number of items to claim at once [default: 4 * concurrency]")
+@click.option("--once", is_flag=True, help="Exit when the queue is empty")
+def scrape_worker(source, concurrency, batch_size, once):
+    """Scrape items from the scrape queue of a source until stopped."""
+    from metadb import worker
+    db.init_db_engine(config.SQLALCHEMY_DATABASE_URI, pool_size=1)
+
+    worker.run(_load_scraper(source), concurrency, batch_size, once)
+
+
 if __name__ == '__main__':
     cli()
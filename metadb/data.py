@@ -1,11 +1,19 @@
+import collections
+import csv
+import io
 import json
+import threading
+import time
 import uuid
 import pytz
 import datetime
 
 from sqlalchemy.sql import text
 
+from . import cache
 from . import db
+from . import log
+from . import util
 
 
 def add_token(admin=False):
@@ -22,6 +30,17 @@ def add_token(admin=False):
         return token
 
 
+# Token lookups are cached in each process, so that authenticating an API
+# request doesn't need a database query. Tokens removed in another process
+# (e.g. with manage.py rmtoken) stay valid here for at most TOKEN_CACHE_TTL seconds.
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60
+# Unknown tokens are cached for less time, so that a new token can be used quickly
+TOKEN_CACHE_NEGATIVE_TTL = 10
+
+_token_cache = cache.TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+
 def remove_token(token):
     try:
         uuid.UUID(token, version=4)
@@ -32,6 +51,7 @@ def remove_token(token):
               WHERE token = :token""")
     with db.engine.begin() as connection:
         connection.execute(query, {"token": token})
+    _token_cache.delete(token)
 
 
 def get_tokens():
@@ -46,10 +66,28 @@ def get_tokens():
 
 
 def get_token(token):
+    """ Look up a token, returning a dictionary {"token": , "admin": }
+        or an empty dictionary if the token doesn't exist.
+        Results are cached for TOKEN_CACHE_TTL seconds.
+    """
     try:
         uuid.UUID(token, version=4)
     except ValueError:
         return {}
+
+    cached = _token_cache.get(token)
+    if cached is not None:
+        return dict(cached)
+
+    row = _load_token(token)
+    if row:
+        _token_cache.set(token, row)
+    else:
+        _token_cache.set(token, row, ttl=TOKEN_CACHE_NEGATIVE_TTL)
+    return dict(row)
+
+
+def _load_token(token):
     query = text("""
         SELECT token::text
              , admin
@@ -63,6 +101,15 @@ def get_token(token):
             return {}
 
 
+def get_token_cache_stats():
+    """ Return the number of hits and misses of the token cache in this process"""
+    return _token_cache.stats()
+
+
+def clear_token_cache():
+    _token_cache.clear()
+
+
 def add_source(name):
     query = text("""
         INSERT INTO source (name)
@@ -71,32 +118,44 @@ def add_source(name):
     with db.engine.begin() as connection:
         result = connection.execute(query, {"name": name})
         id = result.fetchone()[0]
-        return {"name": name, "id": id}
+    clear_registry()
+    return {"name": name, "id": id}
 
 
-def _add_recording_mbids(connection, mbids):
-    check_query = text("""
-        SELECT mbid
-          FROM recording
-         WHERE mbid = :mbid""")
-    insert_query = text("""
+def _add_recording_mbids(connection, mbids, batch_size=10000):
+    """ Insert recording mbids in batches of `batch_size` rows per statement.
+        Returns the mbids which were not already in the table, in the order
+        that they were given.
+    """
+    query = text("""
         INSERT INTO recording (mbid)
-             VALUES (:mbid)""")
+             SELECT unnest(CAST(:mbids AS UUID[]))
+        ON CONFLICT (mbid) DO NOTHING
+          RETURNING mbid::text""")
     ret = []
+    seen = set()
+    unique_mbids = []
     for mbid in mbids:
-        result = connection.execute(check_query, {"mbid": mbid})
-        if not result.rowcount:
-            connection.execute(insert_query, {"mbid": mbid})
-            ret.append(mbid)
+        mbid = str(uuid.UUID(str(mbid)))
+        if mbid not in seen:
+            seen.add(mbid)
+            unique_mbids.append(mbid)
+
+    for batch in util.chunks(unique_mbids, batch_size):
+        result = connection.execute(query, {"mbids": batch})
+        added = set(r[0] for r in result.fetchall())
+        ret.extend([mbid for mbid in batch if mbid in added])
     return ret
 
 
-def add_recording_mbids(mbids):
+def add_recording_mbids(mbids, batch_size=10000):
     """ Add some recording musicbrainzids to the recording table.
         Returns mbids which were added.
+        Arguments:
+          batch_size: the number of mbids to send to the database in each query
     """
     with db.engine.begin() as connection:
-        return _add_recording_mbids(connection, mbids)
+        return _add_recording_mbids(connection, mbids, batch_size)
 
 
 def get_recording_mbids():
@@ -109,17 +168,70 @@ def get_recording_mbids():
         return [dict(r) for r in result.fetchall()]
 
 
-def load_source(name):
-    query = text("""
+# Sources and scrapers rarely change, so all of them are loaded at once and
+# kept in memory. The registry is reloaded when add_source or add_scraper are
+# called, or after REGISTRY_REFRESH_INTERVAL seconds to see changes made by
+# other processes.
+REGISTRY_REFRESH_INTERVAL = 300
+
+_registry = {"loaded": None, "sources": {}, "scrapers": {}}
+_registry_lock = threading.Lock()
+
+
+def _scraper_row_to_dict(row):
+    return {"id": row.id,
+            "source_id": row.source_id,
+            "module": row.module,
+            "mb_type": row.mb_type,
+            "version": row.version,
+            "description": row.description}
+
+
+def _load_registry():
+    source_query = text("""
         SELECT id
              , name
-          FROM source
-         WHERE name = :name""")
+          FROM source""")
+    scraper_query = text("""
+        SELECT id
+             , source_id
+             , module
+             , mb_type
+             , version
+             , description
+          FROM scraper
+      ORDER BY version DESC""")
     with db.engine.begin() as connection:
-        result = connection.execute(query, {"name": name})
-        row = result.fetchone()
-        if row:
-            return {"id": row.id, "name": row.name}
+        result = connection.execute(source_query)
+        sources = {r.name: {"id": r.id, "name": r.name} for r in result.fetchall()}
+        result = connection.execute(scraper_query)
+        scrapers = collections.defaultdict(list)
+        for r in result.fetchall():
+            scrapers[r.source_id].append(_scraper_row_to_dict(r))
+    return {"loaded": time.monotonic(), "sources": sources, "scrapers": dict(scrapers)}
+
+
+def _get_registry():
+    global _registry
+    with _registry_lock:
+        loaded = _registry["loaded"]
+        if loaded is None or time.monotonic() - loaded > REGISTRY_REFRESH_INTERVAL:
+            _registry = _load_registry()
+        return _registry
+
+
+def clear_registry():
+    """ Forget all cached sources and scrapers. They will be reloaded
+        from the database the next time they are needed."""
+    global _registry
+    with _registry_lock:
+        _registry = {"loaded": None, "sources": {}, "scrapers": {}}
+
+
+def load_source(name):
+    source = _get_registry()["sources"].get(name)
+    if source:
+        return dict(source)
     return None
 
 
@@ -142,57 +254,34 @@ def add_scraper(source, module, mb_type, version, description):
         row = result.fetchone()
 
         data["id"] = row.id
-        return data
+        _create_item_partitions(connection, row.id)
+    clear_registry()
+    return data
+
+
+def _create_item_partitions(connection, scraper_id):
+    """Create the partitions of item and item_data which hold the items of a scraper"""
+    scraper_id = int(scraper_id)
+    connection.execute(text("""
+        CREATE TABLE item_{id}
+        PARTITION OF item
+        FOR VALUES IN ({id})""".format(id=scraper_id)))
+    connection.execute(text("""
+        CREATE TABLE item_data_{id}
+        PARTITION OF item_data
+        FOR VALUES IN ({id})""".format(id=scraper_id)))
 
 
 def load_scrapers_for_source(source):
-    query = text("""
-        SELECT id
-             , source_id
-             , module
-             , mb_type
-             , version
-             , description
-          FROM scraper
-         WHERE source_id = :source_id
-        """)
-    with db.engine.begin() as connection:
-        result = connection.execute(query, {"source_id": source["id"]})
-        rows = result.fetchall()
-        ret = []
-        for r in rows:
-            ret.append({"id": r.id,
-                        "source_id": r.source_id,
-                        "module": r.module,
-                        "mb_type": r.mb_type,
-                        "version": r.version,
-                        "description": r.description})
-        return ret
+    scrapers = _get_registry()["scrapers"].get(source["id"], [])
+    return [dict(s) for s in scrapers]
 
 
 def load_latest_scraper_for_source(source):
-    query = text("""
-        SELECT id
-             , source_id
-             , version
-             , mb_type
-             , module
-             , description
-          FROM scraper
-         WHERE source_id = :source_id
-      ORDER BY version DESC
-         LIMIT 1
-        """)
-    with db.engine.begin() as connection:
-        result = connection.execute(query, {"source_id": source["id"]})
-        row = result.fetchone()
-        if row:
-            return {"id": row.id,
-                    "source_id": row.source_id,
-                    "module": row.module,
-                    "mb_type": row.mb_type,
-                    "version": row.version,
-                    "description": row.description}
+    # Scrapers for each source are ordered by version, newest first
+    scrapers = _get_registry()["scrapers"].get(source["id"])
+    if scrapers:
+        return dict(scrapers[0])
     return None
 
 
@@ -208,6 +297,42 @@ class JsonDateTimeEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+def _get_tag_parser(scraper):
+    """Return the parse_tags function of a scraper's module, or None if
+    it doesn't have one or it can't be loaded. Items are still saved without
+    tags if the module fails to load, e.g. because it isn't configured here"""
+    import metadb.scrapers
+    try:
+        module = metadb.scrapers.create_scraper_object(scraper)
+    except ImportError:
+        return None
+    except Exception as e:
+        log.warn("Cannot load %s to index tags: %s", scraper["module"], e)
+        return None
+    return getattr(module, "parse_tags", None)
+
+
+def _parse_item_tags(parse_tags, mbid, data):
+    """Get the tags of an item as a list of (tag, weight).
+    Tags are lowercased, and if a tag appears more than once the highest
+    weight is kept. If the parser fails, the item has no tags, so that one
+    unexpected payload doesn't stop the item (or a whole batch) being saved"""
+    if not parse_tags or not data:
+        return []
+    tags = {}
+    try:
+        if isinstance(data, str):
+            data = json.loads(data)
+        for tag, weight in parse_tags(data):
+            tag = tag.strip().lower()
+            if tag:
+                tags[tag] = max(weight, tags.get(tag, weight))
+    except Exception as e:
+        log.warn("%s: cannot parse tags: %s", mbid, e)
+        return []
+    return list(tags.items())
+
+
 def _add_item_w_connection(connection, scraper, mbid, data):
     check_item_query = text("""
         SELECT *
@@ -222,9 +347,33 @@ def _add_item_w_connection(connection, scraper, mbid, data):
           RETURNING id
         """)
 
+    # Payloads are stored once in item_data_blob, keyed by their hash
     item_data_query = text("""
-        INSERT INTO item_data (item_id, data)
-             VALUES (:item_id, :data)
+          WITH payload AS (
+                SELECT sha256(convert_to(CAST(:data AS JSONB)::text, 'UTF8')) AS hash
+                     , CAST(:data AS JSONB) AS data
+        ), blob AS (
+                INSERT INTO item_data_blob (hash, data)
+                     SELECT hash
+                          , data
+                       FROM payload
+                ON CONFLICT (hash) DO NOTHING
+        )
+        INSERT INTO item_data (item_id, scraper_id, data_hash)
+             SELECT :item_id
+                  , :scraper_id
+                  , hash
+               FROM payload
+        """)
+
+    item_tag_query = text("""
+        INSERT INTO item_tag (scraper_id, mbid, tag, weight)
+             SELECT :scraper_id
+                  , :mbid
+                  , tag
+                  , weight
+               FROM unnest(CAST(:tags AS TEXT[]), CAST(:weights AS INTEGER[])) AS t(tag, weight)
+        ON CONFLICT (scraper_id, mbid, tag) DO NOTHING
         """)
 
     check_result = connection.execute(check_item_query,
@@ -240,15 +389,122 @@ def _add_item_w_connection(connection, scraper, mbid, data):
             if isinstance(data, dict) or isinstance(data, list):
                 data = json.dumps(data, cls=JsonDateTimeEncoder)
             connection.execute(item_data_query, {"item_id": id,
+                                                 "scraper_id": scraper["id"],
                                                  "data": data})
+            tags = _parse_item_tags(_get_tag_parser(scraper), mbid, data)
+            if tags:
+                connection.execute(item_tag_query, {"scraper_id": scraper["id"],
+                                                    "mbid": mbid,
+                                                    "tags": [t for t, _ in tags],
+                                                    "weights": [w for _, w in tags]})
 
         return True
     else:
         return False
 
 
-def get_unprocessed_recordings_for_scraper(scraper, mbid=None):
-    querytxt = """
+def add_items_bulk(scraper, items, copy_size=10000):
+    """ Add many items for a scraper at once.
+        Rows are streamed into a temporary staging table with COPY and then
+        merged into item, item_data and item_tag in a single statement.
+        Items which already exist for this scraper are skipped.
+        Arguments:
+          scraper: the scraper that the data was retrieved with
+          items: an iterable of (mbid, data) tuples
+          copy_size: the number of rows to send in each COPY
+        Returns a dictionary {"inserted": n, "skipped": n}
+    """
+    with db.engine.begin() as connection:
+        return _add_items_bulk_w_connection(connection, scraper, items, copy_size)
+
+
+def _add_items_bulk_w_connection(connection, scraper, items, copy_size=10000):
+    create_staging_query = text("""
+        CREATE TEMPORARY TABLE item_staging (
+          mbid  UUID NOT NULL,
+          data  JSONB
+        ) ON COMMIT DROP;
+        CREATE TEMPORARY TABLE item_tag_staging (
+          mbid    UUID    NOT NULL,
+          tag     TEXT    NOT NULL,
+          weight  INTEGER NOT NULL
+        ) ON COMMIT DROP""")
+
+    merge_query = text("""
+        WITH staged AS (
+            SELECT DISTINCT ON (mbid) mbid
+                 , data
+                 , sha256(convert_to(data::text, 'UTF8')) AS hash
+              FROM item_staging
+        ), new_item AS (
+            INSERT INTO item (scraper_id, mbid)
+                 SELECT :scraper_id
+                      , staged.mbid
+                   FROM staged
+            ON CONFLICT (scraper_id, mbid) DO NOTHING
+              RETURNING id, mbid
+        ), new_blob AS (
+            INSERT INTO item_data_blob (hash, data)
+                 SELECT DISTINCT ON (staged.hash) staged.hash
+                      , staged.data
+                   FROM new_item
+                   JOIN staged
+                     ON staged.mbid = new_item.mbid
+                  WHERE staged.data IS NOT NULL
+            ON CONFLICT (hash) DO NOTHING
+        ), new_item_data AS (
+            INSERT INTO item_data (item_id, scraper_id, data_hash)
+                 SELECT new_item.id
+                      , :scraper_id
+                      , staged.hash
+                   FROM new_item
+                   JOIN staged
+                     ON staged.mbid = new_item.mbid
+                  WHERE staged.data IS NOT NULL
+        ), new_item_tag AS (
+            INSERT INTO item_tag (scraper_id, mbid, tag, weight)
+                 SELECT DISTINCT ON (item_tag_staging.mbid, item_tag_staging.tag) :scraper_id
+                      , item_tag_staging.mbid
+                      , item_tag_staging.tag
+                      , item_tag_staging.weight
+                   FROM new_item
+                   JOIN item_tag_staging
+                     ON item_tag_staging.mbid = new_item.mbid
+            ON CONFLICT (scraper_id, mbid, tag) DO NOTHING
+        )
+        SELECT count(*)
+          FROM new_item""")
+
+    parse_tags = _get_tag_parser(scraper)
+    connection.execute(create_staging_query)
+    cursor = connection.connection.cursor()
+    total = 0
+    for chunk in util.chunks_iter(items, copy_size):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        tagbuf = io.StringIO()
+        tagwriter = csv.writer(tagbuf)
+        for mbid, data in chunk:
+            for tag, weight in _parse_item_tags(parse_tags, mbid, data):
+                tagwriter.writerow([mbid, tag, weight])
+            if not data:
+                data = None
+            elif isinstance(data, dict) or isinstance(data, list):
+                data = json.dumps(data, cls=JsonDateTimeEncoder)
+            writer.writerow([mbid, data])
+        buf.seek(0)
+        cursor.copy_expert("COPY item_staging (mbid, data) FROM STDIN WITH (FORMAT csv)", buf)
+        tagbuf.seek(0)
+        cursor.copy_expert("COPY item_tag_staging (mbid, tag, weight) FROM STDIN WITH (FORMAT csv)", tagbuf)
+        total += len(chunk)
+    cursor.close()
+
+    result = connection.execute(merge_query, {"scraper_id": scraper["id"]})
+    inserted = result.fetchone()[0]
+    return {"inserted": inserted, "skipped": total - inserted}
+
+
+UNPROCESSED_RECORDINGS_QUERY = """
         SELECT recording.mbid::text
              , recording_meta.name
              , recording_meta.artist_credit
@@ -263,17 +519,8 @@ def get_unprocessed_recordings_for_scraper(scraper, mbid=None):
          WHERE item.mbid IS NULL
            AND rr.mbid IS NULL
     """
-    params = {"scraper_id": scraper["id"]}
-    if mbid is not None:
-        querytxt += """AND recording.mbid = :mbid"""
-        params["mbid"] = mbid
-    with db.engine.begin() as connection:
-        result = connection.execute(text(querytxt), params)
-        return [dict(r) for r in result]
-
 
-def get_unprocessed_release_groups_for_scraper(scraper, mbid=None):
-    querytxt = """
+UNPROCESSED_RELEASE_GROUPS_QUERY = """
         SELECT release_group.mbid::text
              , release_group_meta.name
              , release_group_meta.artist_credit
@@ -286,6 +533,21 @@ def get_unprocessed_release_groups_for_scraper(scraper, mbid=None):
            AND item.scraper_id = :scraper_id
          WHERE item.mbid IS NULL
     """
+
+
+def get_unprocessed_recordings_for_scraper(scraper, mbid=None):
+    querytxt = UNPROCESSED_RECORDINGS_QUERY
+    params = {"scraper_id": scraper["id"]}
+    if mbid is not None:
+        querytxt += """AND recording.mbid = :mbid"""
+        params["mbid"] = mbid
+    with db.engine.begin() as connection:
+        result = connection.execute(text(querytxt), params)
+        return [dict(r) for r in result]
+
+
+def get_unprocessed_release_groups_for_scraper(scraper, mbid=None):
+    querytxt = UNPROCESSED_RELEASE_GROUPS_QUERY
     params = {"scraper_id": scraper["id"]}
     if mbid is not None:
         querytxt += """AND release_group.mbid = :mbid"""
@@ -295,6 +557,227 @@ def get_unprocessed_release_groups_for_scraper(scraper, mbid=None):
         return [dict(r) for r in result]
 
 
+def _iter_by_mbid(querytxt, mbid_column, params, batch_size, mbid_range=None):
+    """ Run `querytxt` one batch at a time, ordered by `mbid_column` and
+        starting each batch after the last mbid of the previous one.
+        Only `batch_size` rows are held in memory at once, and no
+        transaction is kept open between batches.
+        If `mbid_range` is a (start, end) tuple from util.uuid_ranges, only
+        return rows with mbids in that range.
+    """
+    params = dict(params)
+    if mbid_range:
+        start, end = mbid_range
+        if start:
+            querytxt += """
+           AND {col} >= :range_start""".format(col=mbid_column)
+            params["range_start"] = start
+        if end:
+            querytxt += """
+           AND {col} < :range_end""".format(col=mbid_column)
+            params["range_end"] = end
+    after_query = text(querytxt + """
+           AND {col} > :after
+      ORDER BY {col}
+         LIMIT :limit""".format(col=mbid_column))
+    first_query = text(querytxt + """
+      ORDER BY {col}
+         LIMIT :limit""".format(col=mbid_column))
+    params["limit"] = batch_size
+    query = first_query
+    while True:
+        with db.engine.begin() as connection:
+            result = connection.execute(query, params)
+            rows = [dict(r) for r in result]
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        query = after_query
+        params["after"] = rows[-1]["mbid"]
+
+
+def iter_unprocessed_recordings_for_scraper(scraper, batch_size=10000, mbid_range=None):
+    """ Like get_unprocessed_recordings_for_scraper, but a generator which
+        reads `batch_size` recordings at a time, in mbid order.
+        `mbid_range` limits the recordings to a range from util.uuid_ranges"""
+    return _iter_by_mbid(UNPROCESSED_RECORDINGS_QUERY, "recording.mbid",
+                         {"scraper_id": scraper["id"]}, batch_size, mbid_range)
+
+
+def iter_unprocessed_release_groups_for_scraper(scraper, batch_size=10000, mbid_range=None):
+    """ Like get_unprocessed_release_groups_for_scraper, but a generator which
+        reads `batch_size` release groups at a time, in mbid order.
+        `mbid_range` limits the release groups to a range from util.uuid_ranges"""
+    return _iter_by_mbid(UNPROCESSED_RELEASE_GROUPS_QUERY, "release_group.mbid",
+                         {"scraper_id": scraper["id"]}, batch_size, mbid_range)
+
+
+def enqueue_scrape(scraper, mbids):
+    """ Add mbids to the scrape queue of a scraper.
+        mbids which are already in the queue are skipped.
+        Returns the number of mbids added.
+    """
+    query = text("""
+        INSERT INTO scrape_queue (scraper_id, mbid)
+             SELECT :scraper_id
+                  , unnest(CAST(:mbids AS UUID[]))
+        ON CONFLICT (scraper_id, mbid) DO NOTHING""")
+    with db.engine.begin() as connection:
+        result = connection.execute(query, {"scraper_id": scraper["id"],
+                                            "mbids": [str(m) for m in mbids]})
+        return result.rowcount
+
+
+def enqueue_unprocessed_scrape(scraper):
+    """ Add every mbid which has no item for a scraper to its scrape queue.
+        Returns the number of mbids added.
+    """
+    if scraper["mb_type"] == "recording":
+        unprocessed_query = UNPROCESSED_RECORDINGS_QUERY
+    else:
+        unprocessed_query = UNPROCESSED_RELEASE_GROUPS_QUERY
+    query = text("""
+        INSERT INTO scrape_queue (scraper_id, mbid)
+             SELECT :scraper_id
+                  , CAST(unprocessed.mbid AS UUID)
+               FROM ({}) AS unprocessed
+        ON CONFLICT (scraper_id, mbid) DO NOTHING""".format(unprocessed_query))
+    with db.engine.begin() as connection:
+        result = connection.execute(query, {"scraper_id": scraper["id"]})
+        return result.rowcount
+
+
+def claim_scrape(scraper, n, lease_seconds=600, max_attempts=5):
+    """ Claim up to n pending items from the scrape queue of a scraper.
+        Items which are claimed by another worker are skipped, so many workers
+        can claim at the same time without getting the same items.
+        An item which isn't completed, failed or released within `lease_seconds`
+        can be claimed again, unless it has already been claimed `max_attempts`
+        times (e.g. because it crashes every worker which scrapes it), in which
+        case it is marked as failed.
+        Returns a list of the same dictionaries as get_unprocessed_*_for_scraper,
+        with an additional key `attempts`.
+    """
+    expire_query = text("""
+        UPDATE scrape_queue
+           SET state = 'failed'
+             , lease_expires = NULL
+             , last_error = 'lease expired'
+         WHERE scraper_id = :scraper_id
+           AND state = 'claimed'
+           AND lease_expires < NOW()
+           AND attempts >= :max_attempts""")
+    claim_query = text("""
+          WITH claimable AS (
+                SELECT scraper_id
+                     , mbid
+                  FROM scrape_queue
+                 WHERE scraper_id = :scraper_id
+                   AND (state = 'pending'
+                        OR (state = 'claimed' AND lease_expires < NOW() AND attempts < :max_attempts))
+                 LIMIT :n
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE scrape_queue
+           SET state = 'claimed'
+             , attempts = scrape_queue.attempts + 1
+             , lease_expires = NOW() + :lease_seconds * INTERVAL '1 second'
+          FROM claimable
+         WHERE scrape_queue.scraper_id = claimable.scraper_id
+           AND scrape_queue.mbid = claimable.mbid
+     RETURNING scrape_queue.mbid::text
+             , scrape_queue.attempts""")
+
+    if scraper["mb_type"] == "recording":
+        meta_query = text("""
+            SELECT mbid::text
+                 , name
+                 , artist_credit
+              FROM recording_meta
+             WHERE mbid = ANY(CAST(:mbids AS UUID[]))""")
+    else:
+        meta_query = text("""
+            SELECT mbid::text
+                 , name
+                 , artist_credit
+                 , first_release_date
+              FROM release_group_meta
+             WHERE mbid = ANY(CAST(:mbids AS UUID[]))""")
+
+    with db.engine.begin() as connection:
+        connection.execute(expire_query, {"scraper_id": scraper["id"],
+                                          "max_attempts": max_attempts})
+        result = connection.execute(claim_query, {"scraper_id": scraper["id"],
+                                                  "n": n,
+                                                  "lease_seconds": lease_seconds,
+                                                  "max_attempts": max_attempts})
+        attempts = {r.mbid: r.attempts for r in result.fetchall()}
+        if not attempts:
+            return []
+        result = connection.execute(meta_query, {"mbids": list(attempts.keys())})
+        meta = {r.mbid: dict(r) for r in result.fetchall()}
+
+    ret = []
+    for mbid, a in attempts.items():
+        item = meta.get(mbid, {"mbid": mbid})
+        item["attempts"] = a
+        ret.append(item)
+    return ret
+
+
+def complete_scrape(scraper, mbids):
+    """ Remove items which have been scraped from the scrape queue of a scraper"""
+    with db.engine.begin() as connection:
+        _complete_scrape_w_connection(connection, scraper, mbids)
+
+
+def _complete_scrape_w_connection(connection, scraper, mbids):
+    query = text("""
+        DELETE FROM scrape_queue
+              WHERE scraper_id = :scraper_id
+                AND mbid = ANY(CAST(:mbids AS UUID[]))""")
+    connection.execute(query, {"scraper_id": scraper["id"],
+                               "mbids": [str(m) for m in mbids]})
+
+
+def fail_scrape(scraper, mbid, error=None, max_attempts=5):
+    """ Mark a claimed item as failed. It is returned to the queue to be tried
+        again unless it has been claimed `max_attempts` times, in which case it
+        isn't claimed again.
+    """
+    query = text("""
+        UPDATE scrape_queue
+           SET state = CASE WHEN attempts >= :max_attempts
+                            THEN 'failed'
+                            ELSE 'pending' END::scrape_queue_state
+             , lease_expires = NULL
+             , last_error = :error
+         WHERE scraper_id = :scraper_id
+           AND mbid = :mbid""")
+    with db.engine.begin() as connection:
+        connection.execute(query, {"scraper_id": scraper["id"],
+                                   "mbid": str(mbid),
+                                   "error": error,
+                                   "max_attempts": max_attempts})
+
+
+def release_scrape(scraper, mbids):
+    """ Return claimed items to the queue without counting the claim as an attempt,
+        e.g. when a worker stops before processing them."""
+    query = text("""
+        UPDATE scrape_queue
+           SET state = 'pending'
+             , attempts = GREATEST(attempts - 1, 0)
+             , lease_expires = NULL
+         WHERE scraper_id = :scraper_id
+           AND mbid = ANY(CAST(:mbids AS UUID[]))
+           AND state = 'claimed'""")
+    with db.engine.begin() as connection:
+        connection.execute(query, {"scraper_id": scraper["id"],
+                                   "mbids": [str(m) for m in mbids]})
+
+
 def get_recordings_missing_meta():
     query = text("""
         SELECT recording.mbid::text
@@ -310,23 +793,60 @@ def get_recordings_missing_meta():
         return [r[0] for r in result.fetchall()]
 
 
-def load_item(mbid, source_name):
-    source = load_source(source_name)
-    scraper = load_latest_scraper_for_source(source)
+def load_item(mbid, source_name, follow_redirects=False):
+    """ Load the item for an mbid from the latest scraper of a source.
+        The source, scraper and item are looked up in a single query.
+        Arguments:
+          follow_redirects: if True and the mbid has been redirected to another
+                            recording, load the item of the recording that it
+                            redirects to. The returned mbid is then the new mbid.
+                            If only the requested mbid has an item, load that one
+        Returns None if there is no such source or item
+    """
+    # Candidate mbids for the item, the one with the lowest priority is used
+    if follow_redirects:
+        candidates_query = """
+                SELECT new_mbid AS mbid
+                     , 0 AS priority
+                  FROM recording_redirect
+                 WHERE mbid = :mbid
+             UNION ALL
+                SELECT CAST(:mbid AS UUID)
+                     , 1"""
+    else:
+        candidates_query = """
+                SELECT CAST(:mbid AS UUID) AS mbid
+                     , 1 AS priority"""
     query = text("""
+          WITH latest_scraper AS (
+                SELECT scraper.id
+                  FROM scraper
+                  JOIN source
+                    ON source.id = scraper.source_id
+                 WHERE source.name = :source_name
+              ORDER BY scraper.version DESC
+                 LIMIT 1
+        ), candidates AS ({})
         SELECT item.id,
                item.mbid,
                item.added,
-               item_data.data
+               item_data_blob.data
           FROM item
+          JOIN candidates
+            ON item.mbid = candidates.mbid
+          JOIN latest_scraper
+            ON item.scraper_id = latest_scraper.id
      LEFT JOIN item_data
             ON item_data.item_id = item.id
-         WHERE item.mbid = :mbid
-           AND item.scraper_id = :scraper_id
-        """)
+           AND item_data.scraper_id = item.scraper_id
+     LEFT JOIN item_data_blob
+            ON item_data_blob.hash = item_data.data_hash
+      ORDER BY candidates.priority
+         LIMIT 1
+        """.format(candidates_query))
     with db.engine.begin() as connection:
-        result = connection.execute(query, {"scraper_id": scraper["id"],
-                                            "mbid": mbid})
+        result = connection.execute(query, {"source_name": source_name,
+                                            "mbid": str(mbid)})
         row = result.fetchone()
         if row:
             return {"id": row.id, "mbid": row.mbid, "added": row.added,
@@ -335,6 +855,155 @@ def load_item(mbid, source_name):
     return None
 
 
+def load_items(mbids, source_name, follow_redirects=False):
+    """ Load the items for many mbids from the latest scraper of a source
+        in a single query. Arguments are the same as load_item.
+        Returns a dictionary of {mbid: item} for each of `mbids` which has an item.
+    """
+    # Candidate mbids for each requested mbid, the one with the lowest priority is used
+    if follow_redirects:
+        requested_query = """
+                SELECT requested.mbid AS requested_mbid
+                     , rr.new_mbid AS mbid
+                     , 0 AS priority
+                  FROM unnest(CAST(:mbids AS UUID[])) AS requested (mbid)
+                  JOIN recording_redirect rr
+                    ON rr.mbid = requested.mbid
+             UNION ALL
+                SELECT requested.mbid AS requested_mbid
+                     , requested.mbid
+                     , 1 AS priority
+                  FROM unnest(CAST(:mbids AS UUID[])) AS requested (mbid)"""
+    else:
+        requested_query = """
+                SELECT DISTINCT requested.mbid AS requested_mbid
+                     , requested.mbid
+                     , 1 AS priority
+                  FROM unnest(CAST(:mbids AS UUID[])) AS requested (mbid)"""
+    query = text("""
+          WITH latest_scraper AS (
+                SELECT scraper.id
+                  FROM scraper
+                  JOIN source
+                    ON source.id = scraper.source_id
+                 WHERE source.name = :source_name
+              ORDER BY scraper.version DESC
+                 LIMIT 1
+        ), requested AS ({})
+        SELECT DISTINCT ON (requested.requested_mbid)
+               requested.requested_mbid::text,
+               item.id,
+               item.mbid,
+               item.added,
+               item_data_blob.data
+          FROM requested
+          JOIN item
+            ON item.mbid = requested.mbid
+          JOIN latest_scraper
+            ON item.scraper_id = latest_scraper.id
+     LEFT JOIN item_data
+            ON item_data.item_id = item.id
+           AND item_data.scraper_id = item.scraper_id
+     LEFT JOIN item_data_blob
+            ON item_data_blob.hash = item_data.data_hash
+      ORDER BY requested.requested_mbid, requested.priority
+        """.format(requested_query))
+    with db.engine.begin() as connection:
+        result = connection.execute(query, {"source_name": source_name,
+                                            "mbids": [str(m) for m in mbids]})
+        ret = {}
+        for row in result.fetchall():
+            ret[row.requested_mbid] = {"id": row.id, "mbid": row.mbid, "added": row.added,
+                                       "data": row.data}
+        return ret
+
+
+def get_mbids_for_tag(tag, source_name, after=None, limit=100):
+    """ Get the mbids of items from the latest scraper of a source which
+        have a tag, ordered by the weight of the tag, highest first.
+        Arguments:
+          tag: the tag to look up, case insensitive
+          source_name: the name of the source
+          after: a (weight, mbid) tuple, the last result of the previous page
+          limit: the maximum number of results
+        Returns a list of {"mbid": mbid, "weight": weight}
+    """
+    after_clause = ""
+    params = {"tag": tag.strip().lower(), "source_name": source_name, "limit": limit}
+    if after:
+        after_clause = "AND (item_tag.weight, item_tag.mbid) < (:after_weight, :after_mbid)"
+        params["after_weight"], params["after_mbid"] = after
+    query = text("""
+          WITH latest_scraper AS (
+                SELECT scraper.id
+                  FROM scraper
+                  JOIN source
+                    ON source.id = scraper.source_id
+                 WHERE source.name = :source_name
+              ORDER BY scraper.version DESC
+                 LIMIT 1
+        )
+        SELECT item_tag.mbid::text
+             , item_tag.weight
+          FROM item_tag
+          JOIN latest_scraper
+            ON item_tag.scraper_id = latest_scraper.id
+         WHERE item_tag.tag = :tag
+           {}
+      ORDER BY item_tag.weight DESC, item_tag.mbid DESC
+         LIMIT :limit
+        """.format(after_clause))
+    with db.engine.begin() as connection:
+        result = connection.execute(query, params)
+        return [dict(r) for r in result]
+
+
+def index_item_tags(scraper, batch_size=10000):
+    """ Add the tags of all existing items of a scraper to item_tag.
+        Returns the number of items which had tags.
+    """
+    items_query = """
+        SELECT item.mbid
+             , item_data_blob.data
+          FROM item
+          JOIN item_data
+            ON item_data.item_id = item.id
+           AND item_data.scraper_id = item.scraper_id
+          JOIN item_data_blob
+            ON item_data_blob.hash = item_data.data_hash
+         WHERE item.scraper_id = :scraper_id"""
+    insert_query = text("""
+        INSERT INTO item_tag (scraper_id, mbid, tag, weight)
+             SELECT :scraper_id
+                  , mbid
+                  , tag
+                  , weight
+               FROM unnest(CAST(:mbids AS UUID[]), CAST(:tags AS TEXT[]), CAST(:weights AS INTEGER[]))
+                 AS t(mbid, tag, weight)
+        ON CONFLICT (scraper_id, mbid, tag) DO NOTHING
+        """)
+    parse_tags = _get_tag_parser(scraper)
+    if not parse_tags:
+        return 0
+    tagged = 0
+    items = _iter_by_mbid(items_query, "item.mbid", {"scraper_id": scraper["id"]}, batch_size)
+    for chunk in util.chunks_iter(items, batch_size):
+        mbids, tags, weights = [], [], []
+        for item in chunk:
+            item_tags = _parse_item_tags(parse_tags, item["mbid"], item["data"])
+            if item_tags:
+                tagged += 1
+            for tag, weight in item_tags:
+                mbids.append(str(item["mbid"]))
+                tags.append(tag)
+                weights.append(weight)
+        if mbids:
+            with db.engine.begin() as connection:
+                connection.execute(insert_query, {"scraper_id": scraper["id"], "mbids": mbids,
+                                                  "tags": tags, "weights": weights})
+    return tagged
+
+
 def _get_recording_meta(connection, recording_mbid):
     # We want to return the timezone always in UTC, regardless of how it's stored in
     # the database, but if you specify a timezone, pg won't return it in the data,
@@ -363,6 +1032,11 @@ def get_recording_meta(recording_mbid):
 
 def musicbrainz_check_mbid_redirect(query_mbid, actual_mbid):
     """Check if we have redirected an mbid"""
+    with db.engine.begin() as connection:
+        _musicbrainz_check_mbid_redirect_w_connection(connection, query_mbid, actual_mbid)
+
+
+def _musicbrainz_check_mbid_redirect_w_connection(connection, query_mbid, actual_mbid):
     if query_mbid == actual_mbid:
         return
 
@@ -378,11 +1052,10 @@ def musicbrainz_check_mbid_redirect(query_mbid, actual_mbid):
              VALUES (:mbid, :new_mbid)""")
 
     params = {"mbid": query_mbid, "new_mbid": actual_mbid}
-    with db.engine.begin() as connection:
-        res = connection.execute(check_query, params)
-        if not res.rowcount:
-            _add_recording_mbids(connection, [actual_mbid])
-            connection.execute(insert_redirect, params)
+    res = connection.execute(check_query, params)
+    if not res.rowcount:
+        _add_recording_mbids(connection, [actual_mbid])
+        connection.execute(insert_redirect, params)
 
 
 def cache_musicbrainz_metadata(recording):
@@ -397,11 +1070,44 @@ def cache_musicbrainz_metadata(recording):
     :return:
     """
 
+    cache_musicbrainz_metadata_many([recording])
+
+
+def cache_musicbrainz_metadata_many(recordings):
+    """
+    Like cache_musicbrainz_metadata, but for a list of recordings.
+    All metadata is written with one statement per table, in a single transaction.
+    As with the single versions, existing metadata is only replaced by
+    metadata with a newer `last_updated` date.
+    :param recordings: a list of recordings from the musicbrainz scraper
+    :return:
+    """
     with db.engine.begin() as connection:
-        _add_recording_meta(connection, recording)
+        _cache_musicbrainz_metadata_many_w_connection(connection, recordings)
+
+
+def _cache_musicbrainz_metadata_many_w_connection(connection, recordings):
+    release_groups = []
+    links = []
+    for recording in recordings:
         for rg in recording["release_group_map"].values():
-            _add_release_group_meta(connection, rg)
-            _add_link_recording_release_group(connection, recording["mbid"], rg["mbid"])
+            release_groups.append(rg)
+            links.append((recording["mbid"], rg["mbid"]))
+
+    _add_recording_meta_many(connection, recordings)
+    _add_release_group_meta_many(connection, release_groups)
+    _add_links_recording_release_group_many(connection, links)
+
+
+def _newest_by_mbid(items):
+    """Return one item for each mbid in `items`, the one with the latest `last_updated`.
+    A row can only be updated once by each INSERT ... ON CONFLICT statement."""
+    newest = collections.OrderedDict()
+    for item in items:
+        existing = newest.get(item["mbid"])
+        if existing is None or existing["last_updated"] < item["last_updated"]:
+            newest[item["mbid"]] = item
+    return list(newest.values())
 
 
 def _add_recording_meta(connection, recording):
@@ -441,6 +1147,31 @@ def _add_recording_meta(connection, recording):
                                "last_updated": recording["last_updated"]})
 
 
+def _add_recording_meta_many(connection, recordings):
+    """
+    Insert or update the metadata of many recordings, using the same
+    last_updated rule as _add_recording_meta
+    """
+    recordings = _newest_by_mbid(recordings)
+    if not recordings:
+        return
+
+    query = text("""
+      INSERT INTO recording_meta (mbid, name, artist_credit, last_updated)
+           SELECT *
+             FROM unnest(CAST(:mbids AS UUID[]), CAST(:names AS TEXT[]),
+                         CAST(:acs AS TEXT[]), CAST(:last_updated AS TIMESTAMP WITH TIME ZONE[]))
+      ON CONFLICT (mbid) DO UPDATE
+              SET name = EXCLUDED.name
+                , artist_credit = EXCLUDED.artist_credit
+                , last_updated = EXCLUDED.last_updated
+            WHERE recording_meta.last_updated < EXCLUDED.last_updated""")
+    connection.execute(query, {"mbids": [r["mbid"] for r in recordings],
+                               "names": [r["name"] for r in recordings],
+                               "acs": [r["artist_credit"] for r in recordings],
+                               "last_updated": [r["last_updated"] for r in recordings]})
+
+
 def get_release_group_meta(release_group_mbid):
     with db.engine.connect() as connection:
         return _get_release_group_meta(connection, release_group_mbid)
@@ -530,3 +1261,61 @@ def _add_link_recording_release_group(connection, recording_mbid, release_group_
         connection.execute(query_insert_recording_rg, {"recording_mbid": recording_mbid,
                                                        "release_group_mbid": release_group_mbid})
 
+
+
+def _add_release_group_meta_many(connection, release_groups):
+    """
+    Add many release groups and their metadata. Existing metadata is only
+    updated if it is older than the new metadata, as in _add_release_group_meta
+    """
+    release_groups = _newest_by_mbid(release_groups)
+    if not release_groups:
+        return
+
+    query_insert_rg = text("""
+        INSERT INTO release_group (mbid)
+             SELECT unnest(CAST(:mbids AS UUID[]))
+        ON CONFLICT (mbid) DO NOTHING""")
+
+    query_rg_meta = text("""
+        INSERT INTO release_group_meta (mbid, name, artist_credit, first_release_date, last_updated)
+             SELECT *
+               FROM unnest(CAST(:mbids AS UUID[]), CAST(:names AS TEXT[]), CAST(:acs AS TEXT[]),
+                           CAST(:first_release_dates AS TEXT[]),
+                           CAST(:last_updated AS TIMESTAMP WITH TIME ZONE[]))
+        ON CONFLICT (mbid) DO UPDATE
+                SET name = EXCLUDED.name
+                  , artist_credit = EXCLUDED.artist_credit
+                  , first_release_date = EXCLUDED.first_release_date
+                  , last_updated = EXCLUDED.last_updated
+              WHERE release_group_meta.last_updated < EXCLUDED.last_updated""")
+
+    mbids = [rg["mbid"] for rg in release_groups]
+    connection.execute(query_insert_rg, {"mbids": mbids})
+    connection.execute(query_rg_meta, {"mbids": mbids,
+                                       "names": [rg["name"] for rg in release_groups],
+                                       "acs": [rg["artist_credit"] for rg in release_groups],
+                                       "first_release_dates": [rg["first_release_date"] for rg in release_groups],
+                                       "last_updated": [rg["last_updated"] for rg in release_groups]})
+
+
+def _add_links_recording_release_group_many(connection, links):
+    """
+    Link recordings to release groups
+    :param links: a list of (recording_mbid, release_group_mbid) tuples
+    """
+    if not links:
+        return
+
+    query = text("""
+        INSERT INTO recording_release_group (recording_mbid, release_group_mbid)
+             SELECT DISTINCT link.recording_mbid
+                  , link.release_group_mbid
+               FROM unnest(CAST(:recording_mbids AS UUID[]), CAST(:release_group_mbids AS UUID[]))
+                 AS link (recording_mbid, release_group_mbid)
+              WHERE NOT EXISTS (SELECT 1
+                                  FROM recording_release_group rrg
+                                 WHERE rrg.recording_mbid = link.recording_mbid
+                                   AND rrg.release_group_mbid = link.release_group_mbid)""")
+    connection.execute(query, {"recording_mbids": [l[0] for l in links],
+                               "release_group_mbids": [l[1] for l in links]})
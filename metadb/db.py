@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event, select
 from sqlalchemy.pool import NullPool
 import sqlalchemy.exc
 
@@ -6,9 +8,66 @@ import sqlalchemy.exc
 engine = None
 
 
-def init_db_engine(connect_str):
+def init_db_engine(connect_str, pool_size=None, max_overflow=10, pool_recycle=-1, pool_pre_ping=False):
+    """ Create the database engine for this process.
+        Arguments:
+          pool_size: the number of connections to keep open. If None, don't
+                     pool connections and open a new one for every transaction
+          max_overflow: the number of connections allowed on top of pool_size
+          pool_recycle: replace connections older than this many seconds (-1 to disable)
+          pool_pre_ping: check that a pooled connection is alive before using it
+    """
     global engine
-    engine = create_engine(connect_str, poolclass=NullPool, server_side_cursors=True)
+    if pool_size is None:
+        engine = create_engine(connect_str, poolclass=NullPool, server_side_cursors=True)
+    else:
+        engine = create_engine(connect_str, pool_size=pool_size, max_overflow=max_overflow,
+                               pool_recycle=pool_recycle, server_side_cursors=True)
+        _protect_pool_from_fork(engine)
+        if pool_pre_ping:
+            _ping_on_checkout(engine)
+
+
+def _protect_pool_from_fork(engine):
+    """Don't let a process use a pooled connection which was opened by its parent.
+    The engine may be created before uwsgi or celery fork their workers, and
+    sharing a socket between processes corrupts the connection."""
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info["pid"] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info["pid"] != pid:
+            connection_record.connection = connection_proxy.connection = None
+            raise sqlalchemy.exc.DisconnectionError(
+                "Connection record belongs to pid %s, attempting to check out in pid %s" %
+                (connection_record.info["pid"], pid))
+
+
+def _ping_on_checkout(engine):
+    """Test each connection with a SELECT 1 when it is first used, and
+    reconnect if the database has gone away since it was returned to the pool."""
+
+    @event.listens_for(engine, "engine_connect")
+    def ping_connection(connection, branch):
+        if branch:
+            return
+
+        save_should_close_with_result = connection.should_close_with_result
+        connection.should_close_with_result = False
+        try:
+            connection.scalar(select([1]))
+        except sqlalchemy.exc.DBAPIError as err:
+            if err.connection_invalidated:
+                # The pool has been invalidated, so this will open a new connection
+                connection.scalar(select([1]))
+            else:
+                raise
+        finally:
+            connection.should_close_with_result = save_should_close_with_result
 
 
 def run_sql_script(sql_file_path, notransaction=False):
@@ -3,13 +3,13 @@ from webserver import create_app
 
 import metadb.scrapers
 from metadb import data
-from metadb import db
 
 
 def make_celery(app):
     celery = Celery(app.import_name, backend=app.config['CELERY_RESULT_BACKEND'],
                     broker=app.config['CELERY_BROKER_URL'])
-    db.init_db_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    # The pooled database engine is created by create_app, and is safe
+    # to use in the worker processes which celery forks from this one
     TaskBase = celery.Task
 
     class ContextTask(TaskBase):
@@ -26,8 +26,6 @@ app = create_app(web=False)
 celery = make_celery(app)
 
 
-# TODO Have a custom task runner to dispose of database connections even if we raise an exception
-# TODO: Or, just try/catch the exception in the correct place??
 @celery.task()
 def scrape_musicbrainz(recording_mbid):
     """
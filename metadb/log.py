@@ -11,3 +11,7 @@ lookuplog.addHandler(ch)
 
 def info(*args, **kwargs):
     lookuplog.info(*args, **kwargs)
+
+
+def warn(*args, **kwargs):
+    lookuplog.warning(*args, **kwargs)
@@ -0,0 +1,45 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Limits the rate of an action over many threads.
+
+    Allows `rate` actions per second on average, and up to `burst` actions
+    at once after a quiet period.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token and return the number of seconds to wait until it
+        is available. Tokens may be taken before they are available, so
+        waiting threads are served in the order that they asked."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Wait until an action is allowed. Returns the number of seconds waited"""
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        """Like acquire, but sleeps without blocking the event loop"""
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
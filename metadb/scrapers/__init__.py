@@ -1,7 +1,13 @@
 import importlib
 
+# Imported scraper modules, by module path
+_modules = {}
+
 
 def create_scraper_object(scraper):
     modulepath = scraper["module"]
-    package = importlib.import_module(modulepath)
+    package = _modules.get(modulepath)
+    if package is None:
+        package = importlib.import_module(modulepath)
+        _modules[modulepath] = package
     return package
@@ -4,6 +4,9 @@ import json
 
 TYPE = "recording"
 
+# The iTunes search API allows about 20 requests per minute
+RATE_LIMIT = 20 / 60
+
 sess = requests.Session()
 adapter = HTTPAdapter(max_retries=5, pool_connections=100, pool_maxsize=100)
 sess.mount("https://itunes.apple.com", adapter)
@@ -17,23 +20,45 @@ def dispose():
     pass
 
 
+SEARCH_URL = "https://itunes.apple.com/search"
+HEADERS = {"User-Agent": "curl/7.47.0"}
+
+
+def _search_params(artist, title):
+    return {"term": "{} {}".format(title.lower(), artist.lower()),
+            "entity": "song"}
+
+
+def _parse_response(content):
+    # If there is no match, this will be an empty string
+    if len(content) == 0:
+        return {}
+    return json.loads(content.decode("utf-8"))
+
+
 def do_itunes_lookup(artist, title):
-    url = "https://itunes.apple.com/search"
+    r = sess.get(SEARCH_URL, params=_search_params(artist, title), headers=HEADERS)
+    # Errors and rate limiting are retried by bulk_lookup
+    if r.status_code >= 500 or r.status_code in (403, 429):
+        r.raise_for_status()
+    return _parse_response(r.content)
+
 
-    params = {"term": "{} {}".format(title.lower(), artist.lower()),
-              "entity": "song"}
+async def do_itunes_lookup_async(session, artist, title):
+    """Like do_itunes_lookup, but with an aiohttp ClientSession"""
+    async with session.get(SEARCH_URL, params=_search_params(artist, title), headers=HEADERS) as r:
+        if r.status >= 500 or r.status in (403, 429):
+            r.raise_for_status()
+        return _parse_response(await r.read())
 
-    headers = {"User-Agent": "curl/7.47.0"}
-    r = sess.get(url, params=params, headers=headers)
-    try:
-        return r.json()
-    except json.decoder.JSONDecodeError:
-        # If there is no match, this will be an empty string
-        content = r.content
-        if len(content) == 0:
-            return {}
-        else:
-            raise
+
+def is_retryable(exc):
+    """Used by bulk_lookup to decide if a failed lookup should be tried again.
+    The iTunes API responds with 403 when the rate limit is exceeded"""
+    status = getattr(getattr(exc, "response", None), "status_code", None) or getattr(exc, "status", None)
+    if status == 403:
+        return True
+    return None
 
 
 def scrape(query):
@@ -45,4 +70,14 @@ def scrape(query):
     return do_itunes_lookup(artist, title)
 
 
+async def scrape_async(query, session):
+    """Like scrape, but with an aiohttp ClientSession, for bulk_lookup --async"""
+    title = query.get("name")
+    artist = query.get("artist_credit")
+    if not title or not artist:
+        return
+
+    return await do_itunes_lookup_async(session, artist, title)
+
+
 
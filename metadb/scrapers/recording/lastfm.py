@@ -1,16 +1,39 @@
+import sys
+
 import requests
 from requests.adapters import HTTPAdapter
 
 LASTFM_KEY = ""
 LASTFM_API_ENDPOINT = 'http://ws.audioscrobbler.com/2.0/'
 
+# Last.fm allows 5 requests per second per IP address
+RATE_LIMIT = 5
+RATE_BURST = 5
+
+# parse_db_data writes rows of [mbid, tag, count, tag, count, ...]
+DUMP_TAG_WEIGHTS = True
+
 sess = requests.Session()
 adapter = HTTPAdapter(max_retries=5, pool_connections=100, pool_maxsize=100)
 sess.mount(LASTFM_API_ENDPOINT, adapter)
 
 
+# Last.fm error codes which may work if the request is made again:
+# 8 operation failed, 11 service offline, 16 temporary error, 29 rate limit exceeded
+RETRYABLE_ERRORS = {8, 11, 16, 29}
+
+
 class ApiException(Exception):
-    pass
+    def __init__(self, message, code=None):
+        super(ApiException, self).__init__(message)
+        self.code = code
+
+
+def is_retryable(exc):
+    """Used by bulk_lookup to decide if a failed lookup should be tried again"""
+    if isinstance(exc, ApiException):
+        return exc.code in RETRYABLE_ERRORS
+    return None
 
 
 def config():
@@ -34,49 +57,84 @@ def parse_db_data(mbid, data, writer):
         print("{} notag".format(mbid), file=sys.stderr)
         return
     else:
-        tags = toptags["tag"]
-        # If there's just 1 tag it's in the dict, not a list
-        if isinstance(tags, dict):
-            tags = [tags]
         towrite = [mbid]
-        for t in tags:
+        for t in _tag_list(toptags):
             towrite.append(t["name"])
             towrite.append(t["count"])
         writer.writerow(towrite)
 
 
-def query(method, **kwargs):
+def _tag_list(toptags):
+    tags = toptags["tag"]
+    # If there's just 1 tag it's in the dict, not a list
+    if isinstance(tags, dict):
+        tags = [tags]
+    return tags
+
+
+def parse_tags(data):
+    """Return a list of (tag, weight) for the tag index"""
+    if "track" in data:
+        data = data["track"]
+    if "toptags" not in data or "tag" not in data["toptags"]:
+        return []
+    return [(t["name"], int(t["count"])) for t in _tag_list(data["toptags"])]
+
+
+HEADERS = {
+    "User-Agent": "lastfmapi",
+}
+
+
+def _query_params(method, kwargs):
     params = dict(kwargs)
     params["method"] = method
     params["api_key"] = LASTFM_KEY
     params["format"] = "json"
+    return params
 
-    headers = {
-        "User-Agent": "lastfmapi",
-    }
 
-    r = sess.get(LASTFM_API_ENDPOINT, params=params, headers=headers)
-    s = r.json()
+def _check_response(s):
     if "error" in s:
-        raise ApiException(s["message"])
+        raise ApiException(s["message"], s["error"])
     return s
 
 
+def query(method, **kwargs):
+    r = sess.get(LASTFM_API_ENDPOINT, params=_query_params(method, kwargs), headers=HEADERS)
+    if r.status_code >= 500:
+        r.raise_for_status()
+    return _check_response(r.json())
+
+
+async def query_async(session, method, **kwargs):
+    """Like query, but with an aiohttp ClientSession"""
+    async with session.get(LASTFM_API_ENDPOINT, params=_query_params(method, kwargs), headers=HEADERS) as r:
+        if r.status >= 500:
+            r.raise_for_status()
+        return _check_response(await r.json(content_type=None))
+
+
+def _scrape_result(data):
+    if "toptags" not in data or "tag" not in data["toptags"]:
+        return {}
+    else:
+        return data
+
+
 def scrape(meta):
     artist = meta["artist_credit"]
     title = meta["name"]
 
-    data = None
     # Since the new lastfm website was released, mbid
     # lookup is unreliable
     # data = query("track.getTopTags", mbid=mbid)
-    try:
-        data = query("track.getTopTags", track=title, artist=artist)
-    except ApiException as ex:
-        raise
+    data = query("track.getTopTags", track=title, artist=artist)
+    return _scrape_result(data)
 
-    if "toptags" not in data or "tag" not in data["toptags"]:
-        return {}
-    else:
-        return data
+
+async def scrape_async(meta, session):
+    """Like scrape, but with an aiohttp ClientSession, for bulk_lookup --async"""
+    data = await query_async(session, "track.getTopTags", track=meta["name"], artist=meta["artist_credit"])
+    return _scrape_result(data)
 
@@ -29,3 +29,8 @@ def scrape(query):
         return musicbrainzdb.scrape(query)
     else:
         return musicbrainzws.scrape(query)
+
+
+def parse_tags(data):
+    """Return a list of (tag, weight) for the tag index"""
+    return [(t["name"], int(t["count"])) for t in data.get("tags", [])]
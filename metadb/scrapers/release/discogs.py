@@ -27,12 +27,16 @@ def config_dump(data_filename):
     DATA["GENRE_TREE_styles"] = set([s for g in GENRE_TREE for s in GENRE_TREE[g]])
 
 
+def normalise_style(style):
+    # Fix a style that was renamed by Discogs at some point in time
+    return style.replace("Shoegazer", "Shoegaze")
+
+
 def extract_style(styles, genres):
     # find a parent genre among genres for each style in styles
     result = []
     for s in list(set(styles)):
-        # Fix a style that was renamed by Discogs at some point in time
-        s = s.replace("Shoegazer", "Shoegaze")
+        s = normalise_style(s)
 
         #if s not in DATA["GENRE_TREE_styles"]:
         #   print("Unknown style: {}".format(s))
@@ -74,6 +78,17 @@ def parse_db_data(mbid, data, writer):
         writer.writerow(row)
 
 
+def parse_tags(data):
+    """Return a list of (tag, weight) for the tag index.
+    Discogs genres and styles have no weight, so they all have a weight of 1"""
+    if not data:
+        return []
+    first = data[0]
+    # extract_style needs the genre tree from config_dump, so only the style names are fixed here
+    tags = set(first['genre'] or []) | set(normalise_style(s) for s in first['style'] or [])
+    return [(t, 1) for t in tags]
+
+
 def scrape(query):
 
     mbid = query['mbid']
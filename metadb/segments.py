@@ -0,0 +1,180 @@
+""" A store of looked up items as a directory of append-only JSONL segments.
+
+Each line of a segment is {"mbid": mbid, "payload": data}. A segment is
+never changed after it is closed, and a new run always starts a new segment.
+Segments are created exclusively, so that many writers (e.g. several
+bulk_lookup processes) can add to the same store.
+When a segment is closed its mbids are written to a sidecar file
+(segment-000001.mbids, one per line), and then a line with its name and
+number of items is added to the index file, so that readers can count items
+and find saved mbids without decompressing the segments.
+
+Segments can be compressed with gzip or zstd (see util.open_file).
+"""
+
+import glob
+import json
+import os
+import threading
+import zlib
+
+from metadb import log
+from metadb import util
+
+# Errors raised when reading the end of a compressed segment which was being
+# written when the writer was killed: part of a gzip member, or a partly
+# written zstd block
+TRUNCATED_ERRORS = (EOFError, zlib.error)
+try:
+    import zstandard
+    TRUNCATED_ERRORS += (zstandard.ZstdError,)
+except ImportError:
+    pass
+
+INDEX_FILENAME = "index.jsonl"
+SEGMENT_PREFIX = "segment-"
+EXTENSIONS = {None: ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+MBIDS_EXTENSION = ".mbids"
+
+
+def is_segment_store(directory):
+    return bool(segment_filenames(directory))
+
+
+def segment_filenames(directory):
+    """All segments in a directory, oldest first. Segments are sorted by their
+    number, which can be wider than the zero padding in their names"""
+    return sorted(glob.glob(os.path.join(directory, SEGMENT_PREFIX + "*.jsonl*")), key=_segment_number)
+
+
+def _segment_number(filename):
+    name = os.path.basename(filename)[len(SEGMENT_PREFIX):]
+    return int(name.split(".")[0])
+
+
+def _mbids_filename(filename):
+    return os.path.join(os.path.dirname(filename), "%s%06d%s" % (SEGMENT_PREFIX, _segment_number(filename), MBIDS_EXTENSION))
+
+
+class SegmentWriter(object):
+    """Writes items to a segment store. Safe to use from many threads.
+    A new segment is started after every `segment_size` items."""
+
+    def __init__(self, directory, segment_size=100000, compress=None):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.extension = EXTENSIONS[compress]
+        self._fp = None
+        self._filename = None
+        self._count = 0
+        self._mbids = []
+        self._lock = threading.Lock()
+        util.mkdir_p(directory)
+        existing = segment_filenames(directory)
+        self._number = _segment_number(existing[-1]) if existing else 0
+
+    def _open_segment(self):
+        # Another writer may have taken the next number since we last looked,
+        # possibly with a different extension
+        while True:
+            self._number += 1
+            name = "%s%06d" % (SEGMENT_PREFIX, self._number)
+            if glob.glob(os.path.join(self.directory, name + ".*")):
+                continue
+            self._filename = os.path.join(self.directory, name + self.extension)
+            try:
+                self._fp = util.open_file(self._filename, "xt")
+                break
+            except FileExistsError:
+                continue
+        self._count = 0
+        self._mbids = []
+
+    def _close_segment(self):
+        self._fp.close()
+        # The index entry is only added once the list of mbids is complete
+        with open(_mbids_filename(self._filename), "w") as fp:
+            fp.writelines(mbid + "\n" for mbid in self._mbids)
+        self._mbids = []
+        with open(os.path.join(self.directory, INDEX_FILENAME), "a") as fp:
+            fp.write(json.dumps({"segment": os.path.basename(self._filename), "count": self._count}) + "\n")
+        self._fp = None
+
+    def write(self, mbid, payload):
+        line = json.dumps({"mbid": mbid, "payload": payload}) + "\n"
+        with self._lock:
+            if not self._fp:
+                self._open_segment()
+            self._fp.write(line)
+            self._mbids.append(mbid)
+            self._count += 1
+            if self._count >= self.segment_size:
+                self._close_segment()
+
+    def close(self):
+        with self._lock:
+            if self._fp:
+                self._close_segment()
+
+
+def read_index(directory):
+    """Returns {segment name: number of items} for the closed segments in a directory"""
+    index = {}
+    indexfile = os.path.join(directory, INDEX_FILENAME)
+    if os.path.exists(indexfile):
+        with open(indexfile) as fp:
+            for line in fp:
+                entry = json.loads(line)
+                index[entry["segment"]] = entry["count"]
+    return index
+
+
+def count_items(directory):
+    """The number of items in a store. Only segments which weren't closed
+    (e.g. because the writer was killed) are read"""
+    index = read_index(directory)
+    total = 0
+    for filename in segment_filenames(directory):
+        name = os.path.basename(filename)
+        if name in index:
+            total += index[name]
+        else:
+            total += sum(1 for _ in _read_segment(filename))
+    return total
+
+
+def _read_segment(filename):
+    # A segment which was being written when the writer was killed can end
+    # with part of a line, or part of a compressed block
+    with util.open_file(filename) as fp:
+        try:
+            for line in fp:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    log.warn("{}: skipping a line which is not valid json".format(filename))
+        except TRUNCATED_ERRORS:
+            log.warn("{}: segment is truncated".format(filename))
+
+
+def read_items(directory):
+    """Yield (mbid, payload) for every item in a store, in the order they were written"""
+    for filename in segment_filenames(directory):
+        for item in _read_segment(filename):
+            yield item["mbid"], item["payload"]
+
+
+def read_mbids(directory):
+    """Yield the mbid of every item in a store. Only segments which weren't
+    closed (or were written before sidecar files existed) are read, the mbids
+    of the others are read from their sidecar files"""
+    index = read_index(directory)
+    for filename in segment_filenames(directory):
+        mbidsfile = _mbids_filename(filename)
+        if os.path.basename(filename) in index and os.path.exists(mbidsfile):
+            with open(mbidsfile) as fp:
+                for line in fp:
+                    yield line.rstrip("\n")
+        else:
+            for item in _read_segment(filename):
+                yield item["mbid"]
@@ -0,0 +1,5 @@
+""" A scraper module for tests, with the same tags as the musicbrainz scraper """
+
+
+def parse_tags(data):
+    return [(t["name"], int(t["count"])) for t in data.get("tags", [])]
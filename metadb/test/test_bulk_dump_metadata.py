@@ -0,0 +1,155 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from metadb.testing import DatabaseTestCase
+from metadb import data
+import bulk_dump_metadata
+
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class StubParser(object):
+
+    def parse_db_data(self, mbid, data, writer):
+        # With include_recordings, mbid is a list of recording mbids
+        for m in mbid if isinstance(mbid, list) else [mbid]:
+            writer.writerow([m, data["n"]])
+
+
+def _lastfm_item(i):
+    return ("mbid%d" % i, {"toptags": {"tag": [{"name": "rock", "count": i}, {"name": "pop%d" % i, "count": 1}]}})
+
+
+class ParseChunksTestCase(unittest.TestCase):
+
+    scraper = {"id": 1, "module": "metadb.scrapers.recording.lastfm", "mb_type": "recording"}
+
+    def _parse(self, jobs):
+        chunks = [[_lastfm_item(i) for i in range(c * 5, c * 5 + 5)] for c in range(10)]
+        pool = bulk_dump_metadata.parser_pool(self.scraper, None, jobs)
+        try:
+            return list(bulk_dump_metadata.parse_chunks(pool, iter(chunks), jobs))
+        finally:
+            if pool:
+                pool.terminate()
+
+    def test_jobs_same_output(self):
+        rows = self._parse(1)
+        self.assertEqual(10, len(rows))
+        self.assertEqual([["mbid%d" % i, "rock", i, "pop%d" % i, 1] for i in range(5)], rows[0])
+        # Rows are in the same order however many processes parse them
+        self.assertEqual(rows, self._parse(3))
+
+
+@unittest.skipUnless(pyarrow, "pyarrow is not installed")
+class ArrowWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parquet(self):
+        filename = os.path.join(self.tmpdir, "dump.parquet")
+        writer = bulk_dump_metadata.ArrowWriter(filename, "parquet", batch_size=2)
+        writer.writerows([["mbid1", "rock", "pop"], ["mbid2"], ["mbid3", "jazz"]])
+        writer.close()
+
+        table = pyarrow.parquet.read_table(filename)
+        # One row group for each batch
+        self.assertEqual(2, pyarrow.parquet.ParquetFile(filename).num_row_groups)
+        self.assertEqual({"mbid": ["mbid1", "mbid2", "mbid3"], "tags": [["rock", "pop"], [], ["jazz"]]},
+                         table.to_pydict())
+
+    def test_arrow_weighted(self):
+        filename = os.path.join(self.tmpdir, "dump.arrow")
+        writer = bulk_dump_metadata.ArrowWriter(filename, "arrow", weighted=True)
+        writer.writerows([["mbid1", "rock", 10, "pop", "2"], ["mbid2", "jazz", 1]])
+        writer.close()
+
+        with pyarrow.ipc.open_file(filename) as reader:
+            table = reader.read_all()
+        self.assertEqual({"mbid": ["mbid1", "mbid2"],
+                          "tags": [[{"tag": "rock", "weight": 10}, {"tag": "pop", "weight": 2}],
+                                   [{"tag": "jazz", "weight": 1}]]},
+                         table.to_pydict())
+
+
+class SinceStateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "state")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_no_state(self):
+        self.assertIsNone(bulk_dump_metadata.read_since_state(self.filename))
+
+    def test_write_read(self):
+        bulk_dump_metadata.write_since_state(self.filename, 10)
+        self.assertEqual(10, bulk_dump_metadata.read_since_state(self.filename))
+        bulk_dump_metadata.write_since_state(self.filename, 25)
+        self.assertEqual(25, bulk_dump_metadata.read_since_state(self.filename))
+        self.assertEqual(["state"], os.listdir(self.tmpdir))
+
+
+class DumpTestCase(DatabaseTestCase):
+
+    def _dump(self, **kwargs):
+        with mock.patch("metadb.scrapers.create_scraper_object") as create, \
+                mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            create.return_value = StubParser()
+            newest = bulk_dump_metadata.dump("test_source", **kwargs)
+            return newest, sorted(stdout.getvalue().splitlines())
+
+    def test_dump_since_id(self):
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "recording", "0.1", "desc")
+        mbids = ["e644e49b-1576-4ef2-b340-147590e9e5ac", "f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9"]
+        data.add_item(scraper, mbids[0], {"n": 0})
+
+        newest, rows = self._dump()
+        self.assertEqual(["%s\t0" % mbids[0]], rows)
+
+        # Only items added after the previous dump are written, even if they
+        # have the same added time
+        data.add_item(scraper, mbids[1], {"n": 1})
+        newer, rows = self._dump(since_id=newest)
+        self.assertEqual(["%s\t1" % mbids[1]], rows)
+        self.assertGreater(newer, newest)
+
+        self.assertEqual((None, []), self._dump(since_id=newer))
+
+    def test_dump_recordings(self):
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "release_group", "0.1", "desc")
+        rgmbid1 = "e644e49b-1576-4ef2-b340-147590e9e5ac"
+        rgmbid2 = "f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9"
+        recmbid1 = "4410602a-7ecc-43a3-94d0-cae6905dffa4"
+        recmbid2 = "77a81b61-da0e-451a-8b53-47d396946285"
+        with data.db.engine.connect() as connection:
+            connection.execute("INSERT INTO release_group (mbid) VALUES (%s), (%s)", (rgmbid1, rgmbid2))
+        data.add_recording_mbids([recmbid1, recmbid2])
+        with data.db.engine.connect() as connection:
+            data._add_link_recording_release_group(connection, recmbid1, rgmbid1)
+            data._add_link_recording_release_group(connection, recmbid2, rgmbid1)
+        data.add_item(scraper, rgmbid1, {"n": 1})
+        data.add_item(scraper, rgmbid2, {"n": 2})
+
+        # Each recording of a release group gets its data, and release groups
+        # without recordings have none
+        _, rows = self._dump(include_recordings=True)
+        self.assertEqual(sorted(["%s\t1" % recmbid1, "%s\t1" % recmbid2]), rows)
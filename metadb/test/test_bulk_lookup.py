@@ -0,0 +1,253 @@
+import asyncio
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+import requests
+
+import bulk_lookup
+from metadb import segments
+
+
+def _http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(response=response)
+
+
+class IsRetryableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.module = mock.Mock(spec=["scrape"])
+
+    def test_http_errors(self):
+        self.assertTrue(bulk_lookup.is_retryable(_http_error(503), self.module))
+        self.assertTrue(bulk_lookup.is_retryable(_http_error(429), self.module))
+        self.assertFalse(bulk_lookup.is_retryable(_http_error(404), self.module))
+
+    def test_connection_errors(self):
+        self.assertTrue(bulk_lookup.is_retryable(requests.ConnectionError(), self.module))
+        self.assertTrue(bulk_lookup.is_retryable(requests.Timeout(), self.module))
+        self.assertTrue(bulk_lookup.is_retryable(TimeoutError(), self.module))
+        self.assertFalse(bulk_lookup.is_retryable(ValueError("bad data"), self.module))
+
+    @unittest.skipUnless(bulk_lookup.aiohttp, "aiohttp is not installed")
+    def test_aiohttp_errors(self):
+        aiohttp = bulk_lookup.aiohttp
+        self.assertTrue(bulk_lookup.is_retryable(aiohttp.ServerDisconnectedError(), self.module))
+        self.assertTrue(bulk_lookup.is_retryable(aiohttp.ClientPayloadError("truncated"), self.module))
+        self.assertTrue(bulk_lookup.is_retryable(
+            aiohttp.ClientResponseError(mock.Mock(), (), status=502), self.module))
+        self.assertFalse(bulk_lookup.is_retryable(
+            aiohttp.ClientResponseError(mock.Mock(), (), status=404), self.module))
+
+    def test_module_decides(self):
+        module = mock.Mock(spec=["scrape", "is_retryable"])
+        module.is_retryable.return_value = True
+        self.assertTrue(bulk_lookup.is_retryable(ValueError("rate limited"), module))
+        module.is_retryable.return_value = False
+        self.assertFalse(bulk_lookup.is_retryable(_http_error(503), module))
+        # None means the module doesn't know
+        module.is_retryable.return_value = None
+        self.assertTrue(bulk_lookup.is_retryable(_http_error(503), module))
+
+    def test_retry_delay(self):
+        for attempt in range(10):
+            delay = bulk_lookup._retry_delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(bulk_lookup.RETRY_MAX_DELAY, bulk_lookup.RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class ProcessTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.journal = bulk_lookup.FailureJournal(os.path.join(self.tmpdir, "failed.csv"))
+        self.module = mock.Mock(spec=["scrape"])
+        self.store = mock.Mock()
+        patcher = mock.patch("bulk_lookup._get_module_by_path", return_value=self.module)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("bulk_lookup.time.sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _query(self, mbid):
+        return {"mbid": mbid, "artist": "artist", "module": "fake", "save": True}
+
+    def _read_journal(self):
+        self.journal.close()
+        with open(self.journal.filename, newline="") as fp:
+            return list(csv.DictReader(fp))
+
+    def test_retry_then_succeed(self):
+        self.module.scrape.side_effect = [requests.ConnectionError("reset"), _http_error(503), {"data": 1}]
+        self.assertTrue(bulk_lookup.process(self._query("a"), check_saved=False, retries=2,
+                                            journal=self.journal, store=self.store))
+        self.assertEqual(3, self.module.scrape.call_count)
+        self.assertEqual(2, self.sleep.call_count)
+        self.store.write.assert_called_once_with("a", {"data": 1})
+        self.assertEqual(0, self.journal.count)
+
+    def test_retries_run_out(self):
+        self.module.scrape.side_effect = requests.ConnectionError("reset")
+        bulk_lookup.process(self._query("a"), check_saved=False, retries=2, journal=self.journal, store=self.store)
+        self.assertEqual(3, self.module.scrape.call_count)
+        self.store.write.assert_not_called()
+        self.assertEqual([{"mbid": "a", "artist": "artist", "error": "reset"}], self._read_journal())
+
+    def test_permanent_error_not_retried(self):
+        self.module.scrape.side_effect = [_http_error(404), ValueError("no match"), _http_error(503)]
+        for mbid in ["a", "b", "c"]:
+            bulk_lookup.process(self._query(mbid), check_saved=False, retries=0, journal=self.journal,
+                                store=self.store)
+        self.assertEqual(3, self.module.scrape.call_count)
+        self.sleep.assert_not_called()
+        # Only the temporary error is tried again in a later run
+        self.assertEqual(["c"], [row["mbid"] for row in self._read_journal()])
+        self.assertEqual(1, self.journal.count)
+
+
+class StubScraper(object):
+    RATE_LIMIT = 1000
+    RATE_BURST = 100
+
+    def scrape(self, query):
+        if query["mbid"] == "nomatch":
+            raise ValueError("no match")
+        if query["mbid"] == "timeout":
+            raise TimeoutError("timeout")
+        return {"mbid": query["mbid"], "async": False}
+
+
+class StubAsyncScraper(StubScraper):
+
+    async def scrape_async(self, query, session):
+        await asyncio.sleep(0.01)
+        if query["mbid"] == "nomatch":
+            raise ValueError("no match")
+        if query["mbid"] == "timeout":
+            raise TimeoutError("timeout")
+        return {"mbid": query["mbid"], "async": True}
+
+
+@unittest.skipUnless(bulk_lookup.aiohttp, "aiohttp is not installed")
+class ProcessFileAsyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "items.csv")
+        self.mbids = ["mbid%d" % i for i in range(20)] + ["nomatch", "timeout"]
+        with open(self.filename, "w", newline="") as fp:
+            writer = csv.writer(fp)
+            writer.writerow(["mbid", "artist"])
+            for mbid in self.mbids:
+                writer.writerow([mbid, "artist"])
+        self.store = mock.Mock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _process_file(self, module):
+        with mock.patch("bulk_lookup._get_module_by_path", return_value=module):
+            bulk_lookup.process_file_async("fake", self.filename, 4, save=True, retries=0, store=self.store)
+        return sorted(c[0] for c in self.store.write.call_args_list)
+
+    def _read_journal(self):
+        with open(os.path.join(self.tmpdir, "items.failed.csv"), newline="") as fp:
+            return list(csv.DictReader(fp))
+
+    def test_scrape_async(self):
+        results = self._process_file(StubAsyncScraper())
+        self.assertEqual(sorted(("mbid%d" % i, {"mbid": "mbid%d" % i, "async": True}) for i in range(20)), results)
+        self.assertEqual([{"mbid": "timeout", "artist": "artist", "error": "timeout"}], self._read_journal())
+
+    def test_scrape_in_executor(self):
+        results = self._process_file(StubScraper())
+        self.assertEqual(sorted(("mbid%d" % i, {"mbid": "mbid%d" % i, "async": False}) for i in range(20)), results)
+        self.assertEqual(["timeout"], [row["mbid"] for row in self._read_journal()])
+
+
+class FindSavedMbidsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.module = os.path.join(self.tmpdir, "metadb.scrapers.recording.test")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _save(self, mbid):
+        bulk_lookup.save({}, os.path.join(self.module, mbid[:2], "%s.json" % mbid))
+
+    def test_missing_directory(self):
+        self.assertEqual(set(), bulk_lookup.find_saved_mbids(self.module))
+
+    def test_find_saved(self):
+        mbid1 = "e644e49b-1576-4ef2-b340-147590e9e5ac"
+        mbid2 = "F84CA3BF-E561-41BB-9BA3-F8B7D79E3AF9"
+        self._save(mbid1)
+        self._save(mbid2)
+        # Names which aren't mbids are kept as they are
+        self._save("not-an-mbid")
+        # Files which bulk_lookup doesn't write are ignored
+        with open(os.path.join(self.module, "e6", "notes.txt"), "w") as fp:
+            fp.write("")
+        with open(os.path.join(self.module, "top.json"), "w") as fp:
+            fp.write("{}")
+
+        saved = bulk_lookup.find_saved_mbids(self.module)
+        self.assertEqual(3, len(saved))
+        self.assertIn(bulk_lookup._mbid_key(mbid1), saved)
+        # mbids are found whatever their case
+        self.assertIn(bulk_lookup._mbid_key(mbid2.lower()), saved)
+        self.assertIn(bulk_lookup._mbid_key("not-an-mbid"), saved)
+        self.assertNotIn(bulk_lookup._mbid_key("4410602a-7ecc-43a3-94d0-cae6905dffa4"), saved)
+
+    def test_find_saved_with_segments(self):
+        mbid1 = "e644e49b-1576-4ef2-b340-147590e9e5ac"
+        mbid2 = "f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9"
+        self._save(mbid1)
+        writer = segments.SegmentWriter(self.module)
+        writer.write(mbid2, {})
+        writer.close()
+
+        self.assertEqual({bulk_lookup._mbid_key(mbid1), bulk_lookup._mbid_key(mbid2)},
+                         bulk_lookup.find_saved_mbids(self.module))
+
+
+class FailureJournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_no_failures(self):
+        journal = bulk_lookup.FailureJournal(os.path.join(self.tmpdir, "failed.csv"))
+        journal.close()
+        self.assertEqual([], os.listdir(self.tmpdir))
+
+    def test_record(self):
+        filename = os.path.join(self.tmpdir, "failed.csv")
+        journal = bulk_lookup.FailureJournal(filename)
+        journal.record({"mbid": "a", "artist": "x, y", "module": "m", "save": True}, Exception("timeout"))
+        journal.record({"mbid": "b", "artist": "z", "module": "m", "save": True}, Exception("gone"))
+        journal.close()
+        self.assertEqual(2, journal.count)
+
+        # The journal can be used as the input of another run
+        with open(filename, newline="") as fp:
+            self.assertEqual([{"mbid": "a", "artist": "x, y", "error": "timeout"},
+                              {"mbid": "b", "artist": "z", "error": "gone"}], list(csv.DictReader(fp)))
+
+    def test_failures_filename(self):
+        self.assertEqual("/data/items.failed.csv", bulk_lookup.failures_filename("/data/items.csv.gz"))
+        self.assertEqual("items.failed.csv", bulk_lookup.failures_filename("items.csv"))
@@ -0,0 +1,49 @@
+import unittest
+
+import mock
+
+from metadb import cache
+
+
+class TTLCacheTestCase(unittest.TestCase):
+
+    def test_get_set(self):
+        c = cache.TTLCache(10, 60)
+        self.assertIsNone(c.get("a"))
+        c.set("a", 1)
+        self.assertEqual(1, c.get("a"))
+        self.assertIn("a", c)
+        self.assertEqual({"hits": 1, "misses": 1, "size": 1}, c.stats())
+
+    @mock.patch("metadb.cache.time.monotonic")
+    def test_expiry(self, monotonic):
+        monotonic.return_value = 100
+        c = cache.TTLCache(10, 60)
+        c.set("a", 1)
+        c.set("b", 2, ttl=5)
+
+        monotonic.return_value = 106
+        self.assertEqual(1, c.get("a"))
+        self.assertIsNone(c.get("b"))
+
+        monotonic.return_value = 161
+        self.assertIsNone(c.get("a"))
+        self.assertEqual(0, c.stats()["size"])
+
+    def test_least_recently_used_removed(self):
+        c = cache.TTLCache(2, 60)
+        c.set("a", 1)
+        c.set("b", 2)
+        # a is now more recently used than b
+        c.get("a")
+        c.set("c", 3)
+        self.assertEqual(1, c.get("a"))
+        self.assertIsNone(c.get("b"))
+        self.assertEqual(3, c.get("c"))
+
+    def test_delete(self):
+        c = cache.TTLCache(2, 60)
+        c.set("a", 1)
+        c.delete("a")
+        c.delete("notexists")
+        self.assertIsNone(c.get("a"))
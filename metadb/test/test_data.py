@@ -18,6 +18,27 @@ class DataTestCase(DatabaseTestCase):
         self.assertEqual(len(getscraper), 1)
         self.assertEqual(getscraper[0], scraper)
 
+    def test_add_scraper_creates_partitions(self):
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "recording", "0.1", "desc")
+        data.add_item(scraper, "e644e49b-1576-4ef2-b340-147590e9e5ac", {"test": "data"})
+
+        with data.db.engine.connect() as connection:
+            result = connection.execute("SELECT count(*) FROM item_%s" % scraper["id"])
+            self.assertEqual(1, result.fetchone()[0])
+            result = connection.execute("SELECT count(*) FROM item_data_%s" % scraper["id"])
+            self.assertEqual(1, result.fetchone()[0])
+            result = connection.execute("SELECT count(*) FROM item_default")
+            self.assertEqual(0, result.fetchone()[0])
+
+    def test_create_indexes(self):
+        # The scripts run by init_db are committed, with all of their statements
+        with data.db.engine.connect() as connection:
+            result = connection.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'metadb'")
+            indexes = set(r[0] for r in result.fetchall())
+        self.assertLessEqual({"item_ndx_mbid", "item_ndx_added", "item_tag_ndx_tag_weight",
+                              "scrape_queue_ndx_claim"}, indexes)
+
     def test_load_latest_scraper(self):
         source = data.add_source("test_source")
         scrapernew = data.add_scraper(source, "module", "recording", "0.2", "desc")
@@ -35,6 +56,22 @@ class DataTestCase(DatabaseTestCase):
         getscraper = data.load_latest_scraper_for_source(other_source)
         self.assertIsNone(getscraper)
 
+    def test_source_registry_cached(self):
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "recording", "0.1", "desc")
+        self.assertEqual(source, data.load_source("test_source"))
+
+        # Sources and scrapers are now served from memory
+        with mock.patch("metadb.data._load_registry") as load_registry:
+            self.assertEqual(source, data.load_source("test_source"))
+            self.assertEqual(scraper, data.load_latest_scraper_for_source(source))
+            self.assertIsNone(data.load_source("other_source"))
+            load_registry.assert_not_called()
+
+        # Adding a scraper reloads the registry
+        scrapernew = data.add_scraper(source, "module", "recording", "0.2", "desc")
+        self.assertEqual(scrapernew, data.load_latest_scraper_for_source(source))
+
     def test_add_recording_mbids(self):
         recordings = data.get_recording_mbids()
         self.assertEqual(0, len(recordings))
@@ -48,6 +85,21 @@ class DataTestCase(DatabaseTestCase):
         recordings = data.get_recording_mbids()
         self.assertEqual(3, len(recordings))
 
+    def test_add_recording_mbids_batches(self):
+        mbids = ["232ecd2b-7369-41a8-be13-1ed34c3712f7", "10da17c9-3e8a-4268-87ca-ccf52a91bd6d"]
+        data.add_recording_mbids(mbids)
+
+        # Only new mbids are returned, in the order given, even when split
+        # over many batches and with duplicates in the input
+        newmbids = ["9814edcf-24a2-4ef7-bd04-8db0dddaf575", "10da17c9-3e8a-4268-87ca-ccf52a91bd6d",
+                    "f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9", "9814edcf-24a2-4ef7-bd04-8db0dddaf575",
+                    "232ecd2b-7369-41a8-be13-1ed34c3712f7", "4410602a-7ecc-43a3-94d0-cae6905dffa4"]
+        added = data.add_recording_mbids(newmbids, batch_size=2)
+        self.assertEqual(["9814edcf-24a2-4ef7-bd04-8db0dddaf575", "f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9",
+                          "4410602a-7ecc-43a3-94d0-cae6905dffa4"], added)
+        recordings = data.get_recording_mbids()
+        self.assertEqual(5, len(recordings))
+
     def test_add_item(self):
         source = data.add_source("test_source")
         scraper = data.add_scraper(source, "module", "recording", "version", "desc")
@@ -65,6 +117,91 @@ class DataTestCase(DatabaseTestCase):
         res = data.add_item(scraper, mbid, payload)
         self.assertEqual(res, False)
 
+    def test_load_item_follow_redirects(self):
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "recording", "version", "desc")
+
+        mbid = "4410602a-7ecc-43a3-94d0-cae6905dffa4"
+        new_mbid = "77a81b61-da0e-451a-8b53-47d396946285"
+        data.add_recording_mbids([mbid])
+        data.musicbrainz_check_mbid_redirect(mbid, new_mbid)
+        data.add_item(scraper, new_mbid, {"test": "data"})
+
+        self.assertIsNone(data.load_item(mbid, "test_source"))
+        item = data.load_item(mbid, "test_source", follow_redirects=True)
+        self.assertEqual(new_mbid, str(item["mbid"]))
+        self.assertEqual({"test": "data"}, item["data"])
+
+        # An mbid which isn't redirected is loaded as normal
+        item = data.load_item(new_mbid, "test_source", follow_redirects=True)
+        self.assertEqual({"test": "data"}, item["data"])
+
+        # An unknown source returns nothing
+        self.assertIsNone(data.load_item(new_mbid, "other_source", follow_redirects=True))
+
+    def test_load_item_redirect_only_old_item(self):
+        """If an mbid is redirected but only the old mbid has an item, load that item"""
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "recording", "version", "desc")
+
+        mbid = "4410602a-7ecc-43a3-94d0-cae6905dffa4"
+        new_mbid = "77a81b61-da0e-451a-8b53-47d396946285"
+        data.add_recording_mbids([mbid])
+        data.musicbrainz_check_mbid_redirect(mbid, new_mbid)
+        data.add_item(scraper, mbid, {"test": "old"})
+
+        item = data.load_item(mbid, "test_source", follow_redirects=True)
+        self.assertEqual(mbid, str(item["mbid"]))
+        self.assertEqual({"test": "old"}, item["data"])
+
+        # Once the new mbid has an item, it is used instead
+        data.add_item(scraper, new_mbid, {"test": "new"})
+        item = data.load_item(mbid, "test_source", follow_redirects=True)
+        self.assertEqual({"test": "new"}, item["data"])
+
+    def test_load_items(self):
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "recording", "version", "desc")
+
+        mbid = "4410602a-7ecc-43a3-94d0-cae6905dffa4"
+        new_mbid = "77a81b61-da0e-451a-8b53-47d396946285"
+        other_mbid = "f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9"
+        data.add_recording_mbids([mbid])
+        data.musicbrainz_check_mbid_redirect(mbid, new_mbid)
+        data.add_item(scraper, new_mbid, {"test": "data"})
+
+        items = data.load_items([mbid, new_mbid, other_mbid], "test_source")
+        self.assertEqual([new_mbid], list(items.keys()))
+        self.assertEqual({"test": "data"}, items[new_mbid]["data"])
+
+        items = data.load_items([mbid, new_mbid, other_mbid], "test_source", follow_redirects=True)
+        self.assertCountEqual([mbid, new_mbid], items.keys())
+        self.assertEqual({"test": "data"}, items[mbid]["data"])
+
+        # A redirected mbid where only the old mbid has an item
+        old_mbid = "10da17c9-3e8a-4268-87ca-ccf52a91bd6d"
+        data.add_recording_mbids([old_mbid])
+        data.musicbrainz_check_mbid_redirect(old_mbid, other_mbid)
+        data.add_item(scraper, old_mbid, {"test": "old"})
+        items = data.load_items([old_mbid], "test_source", follow_redirects=True)
+        self.assertEqual({"test": "old"}, items[old_mbid]["data"])
+
+    def test_add_item_deduplicates_data(self):
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "recording", "version", "desc")
+
+        payload = {"toptags": {"tag": []}}
+        data.add_item(scraper, "e644e49b-1576-4ef2-b340-147590e9e5ac", payload)
+        data.add_items_bulk(scraper, [("f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9", payload),
+                                      ("4410602a-7ecc-43a3-94d0-cae6905dffa4", {"other": "data"})])
+
+        # Identical payloads are stored once
+        with data.db.engine.connect() as connection:
+            result = connection.execute("SELECT count(*) FROM item_data_blob")
+            self.assertEqual(2, result.fetchone()[0])
+        self.assertEqual(payload, data.load_item("e644e49b-1576-4ef2-b340-147590e9e5ac", "test_source")["data"])
+        self.assertEqual(payload, data.load_item("f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9", "test_source")["data"])
+
     def test_add_item_no_data(self):
         """Adding an item with no data will add an item row but no
            item_data, causing load_item to return nothing."""
@@ -80,6 +217,87 @@ class DataTestCase(DatabaseTestCase):
         item = data.load_item(mbid, "test_source")
         self.assertIsNone(item["data"])
 
+    def test_add_items_bulk(self):
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "recording", "version", "desc")
+
+        existing = "e644e49b-1576-4ef2-b340-147590e9e5ac"
+        data.add_item(scraper, existing, {"test": "existing"})
+
+        items = [(existing, {"test": "new"}),
+                 ("f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9", {"test": "data\twith\nescapes"}),
+                 ("4410602a-7ecc-43a3-94d0-cae6905dffa4", {}),
+                 ("77a81b61-da0e-451a-8b53-47d396946285", [1, 2])]
+        res = data.add_items_bulk(scraper, iter(items), copy_size=2)
+        self.assertEqual({"inserted": 3, "skipped": 1}, res)
+
+        # Existing items are not overwritten
+        self.assertEqual({"test": "existing"}, data.load_item(existing, "test_source")["data"])
+        item = data.load_item("f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9", "test_source")
+        self.assertEqual({"test": "data\twith\nescapes"}, item["data"])
+        # Empty data adds an item but no item_data
+        item = data.load_item("4410602a-7ecc-43a3-94d0-cae6905dffa4", "test_source")
+        self.assertIsNone(item["data"])
+        item = data.load_item("77a81b61-da0e-451a-8b53-47d396946285", "test_source")
+        self.assertEqual([1, 2], item["data"])
+
+    def test_item_tags(self):
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "metadb.test.stub_scraper", "recording", "version", "desc")
+
+        mbid1 = "e644e49b-1576-4ef2-b340-147590e9e5ac"
+        mbid2 = "f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9"
+        mbid3 = "4410602a-7ecc-43a3-94d0-cae6905dffa4"
+        data.add_item(scraper, mbid1, {"tags": [{"name": "Rock", "count": 2}, {"name": "pop", "count": 1}]})
+        data.add_items_bulk(scraper, [(mbid2, {"tags": [{"name": "rock", "count": 5}]}),
+                                      (mbid3, {"tags": [{"name": "rock", "count": 2}]})])
+
+        self.assertEqual([{"mbid": mbid2, "weight": 5}, {"mbid": mbid1, "weight": 2}, {"mbid": mbid3, "weight": 2}],
+                         data.get_mbids_for_tag("ROCK", "test_source"))
+        self.assertEqual([{"mbid": mbid2, "weight": 5}], data.get_mbids_for_tag("rock", "test_source", limit=1))
+        self.assertEqual([{"mbid": mbid3, "weight": 2}],
+                         data.get_mbids_for_tag("rock", "test_source", after=(2, mbid1)))
+        self.assertEqual([{"mbid": mbid1, "weight": 1}], data.get_mbids_for_tag("pop", "test_source"))
+        self.assertEqual([], data.get_mbids_for_tag("rock", "other_source"))
+
+        # Items added before the tag index existed
+        with data.db.engine.begin() as connection:
+            connection.execute("DELETE FROM item_tag")
+        self.assertEqual(3, data.index_item_tags(scraper, batch_size=2))
+        self.assertEqual(3, len(data.get_mbids_for_tag("rock", "test_source")))
+
+    def test_item_tags_parse_error(self):
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "metadb.test.stub_scraper", "recording", "version", "desc")
+
+        mbid1 = "e644e49b-1576-4ef2-b340-147590e9e5ac"
+        mbid2 = "f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9"
+        mbid3 = "4410602a-7ecc-43a3-94d0-cae6905dffa4"
+        # Tags without a count can't be parsed, but the items are still saved
+        data.add_item(scraper, mbid1, {"tags": [{"name": "rock"}]})
+        data.add_items_bulk(scraper, [(mbid2, {"tags": [{"name": "rock", "count": 5}]}),
+                                      (mbid3, {"tags": "rock"})])
+
+        self.assertEqual({"tags": [{"name": "rock"}]}, data.load_item(mbid1, "test_source")["data"])
+        self.assertEqual({"tags": "rock"}, data.load_item(mbid3, "test_source")["data"])
+        self.assertEqual([{"mbid": mbid2, "weight": 5}], data.get_mbids_for_tag("rock", "test_source"))
+
+    def test_item_tags_parser_not_loaded(self):
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "metadb.test.stub_scraper", "recording", "version", "desc")
+
+        mbid1 = "e644e49b-1576-4ef2-b340-147590e9e5ac"
+        mbid2 = "f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9"
+        # e.g. a module which needs configuration that this process doesn't have
+        with mock.patch("metadb.scrapers.create_scraper_object") as create:
+            create.side_effect = AttributeError("'NoneType' object has no attribute '_instantiate_plugins'")
+            data.add_item(scraper, mbid1, {"tags": [{"name": "rock", "count": 2}]})
+            data.add_items_bulk(scraper, [(mbid2, {"tags": [{"name": "rock", "count": 5}]})])
+
+        self.assertEqual({"tags": [{"name": "rock", "count": 2}]}, data.load_item(mbid1, "test_source")["data"])
+        self.assertEqual({"tags": [{"name": "rock", "count": 5}]}, data.load_item(mbid2, "test_source")["data"])
+        self.assertEqual([], data.get_mbids_for_tag("rock", "test_source"))
+
     def test_get_recordings_missing_meta(self):
         mbids = ["f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9", "4410602a-7ecc-43a3-94d0-cae6905dffa4",
                  "77a81b61-da0e-451a-8b53-47d396946285"]
@@ -155,6 +373,35 @@ class ScraperTestCase(DatabaseTestCase):
         unprocessed = data.get_unprocessed_recordings_for_scraper(scraper)
         self.assertCountEqual(["77a81b61-da0e-451a-8b53-47d396946285"], [u["mbid"] for u in unprocessed])
 
+    def test_iter_unprocessed_recordings(self):
+        mbids = ["f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9", "4410602a-7ecc-43a3-94d0-cae6905dffa4",
+                 "77a81b61-da0e-451a-8b53-47d396946285", "10da17c9-3e8a-4268-87ca-ccf52a91bd6d",
+                 "232ecd2b-7369-41a8-be13-1ed34c3712f7"]
+        data.add_recording_mbids(mbids)
+        now = datetime.datetime.now()
+        with data.db.engine.begin() as connection:
+            for m in mbids:
+                data._add_recording_meta(connection, {"mbid": m, "name": "name", "artist_credit": "ac",
+                                                      "last_updated": now})
+
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "recording", "0.1", "desc")
+        data.add_item(scraper, "77a81b61-da0e-451a-8b53-47d396946285", {"test": "data"})
+
+        # Rows are returned in mbid order over many batches, with no duplicates
+        unprocessed = list(data.iter_unprocessed_recordings_for_scraper(scraper, batch_size=2))
+        expected = sorted(["f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9", "4410602a-7ecc-43a3-94d0-cae6905dffa4",
+                           "10da17c9-3e8a-4268-87ca-ccf52a91bd6d", "232ecd2b-7369-41a8-be13-1ed34c3712f7"])
+        self.assertEqual(expected, [u["mbid"] for u in unprocessed])
+        self.assertEqual({"mbid": expected[0], "name": "name", "artist_credit": "ac"}, unprocessed[0])
+
+        # Each mbid is in exactly one range
+        ranges = data.util.uuid_ranges(3)
+        sharded = [[u["mbid"] for u in data.iter_unprocessed_recordings_for_scraper(scraper, 2, r)] for r in ranges]
+        self.assertEqual([["10da17c9-3e8a-4268-87ca-ccf52a91bd6d", "232ecd2b-7369-41a8-be13-1ed34c3712f7",
+                           "4410602a-7ecc-43a3-94d0-cae6905dffa4"], [], ["f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9"]],
+                         sharded)
+
     def test_get_unprocessed_recordings_no_id(self):
         """If we ask for unprocessed recordings and specify an ID which isn't in the
            database, (or is already processed???), it returns nothing"""
@@ -215,6 +462,69 @@ class ScraperTestCase(DatabaseTestCase):
         self.assertCountEqual(unprocessed, [meta[1]])
 
 
+    def test_scrape_queue(self):
+        mbids = ["f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9", "4410602a-7ecc-43a3-94d0-cae6905dffa4",
+                 "77a81b61-da0e-451a-8b53-47d396946285"]
+        data.add_recording_mbids(mbids)
+        now = datetime.datetime.now()
+        with data.db.engine.begin() as connection:
+            for m in mbids:
+                data._add_recording_meta(connection, {"mbid": m, "name": "name", "artist_credit": "ac",
+                                                      "last_updated": now})
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "recording", "0.1", "desc")
+        data.add_item(scraper, mbids[0], {"test": "data"})
+
+        self.assertEqual(2, data.enqueue_unprocessed_scrape(scraper))
+        # Items already in the queue aren't added again
+        self.assertEqual(1, data.enqueue_scrape(scraper, mbids))
+        self.assertEqual(0, data.enqueue_unprocessed_scrape(scraper))
+
+        claimed = data.claim_scrape(scraper, 2)
+        self.assertEqual(2, len(claimed))
+        self.assertEqual({"name": "name", "artist_credit": "ac", "attempts": 1},
+                         {k: v for k, v in claimed[0].items() if k != "mbid"})
+        # Claimed items aren't claimed again
+        claimed_rest = data.claim_scrape(scraper, 2)
+        self.assertEqual(1, len(claimed_rest))
+        self.assertEqual(set(mbids), set(c["mbid"] for c in claimed + claimed_rest))
+        self.assertEqual([], data.claim_scrape(scraper, 2))
+
+        # Completed items are removed, failed and released items can be claimed again
+        data.complete_scrape(scraper, [claimed[0]["mbid"]])
+        data.fail_scrape(scraper, claimed[1]["mbid"], "timeout")
+        data.release_scrape(scraper, [claimed_rest[0]["mbid"]])
+        reclaimed = data.claim_scrape(scraper, 10)
+        self.assertCountEqual([(claimed[1]["mbid"], 2), (claimed_rest[0]["mbid"], 1)],
+                              [(c["mbid"], c["attempts"]) for c in reclaimed])
+
+        # After too many attempts an item isn't claimed again
+        data.fail_scrape(scraper, claimed[1]["mbid"], "timeout", max_attempts=2)
+        data.release_scrape(scraper, [claimed_rest[0]["mbid"]])
+        self.assertEqual([claimed_rest[0]["mbid"]], [c["mbid"] for c in data.claim_scrape(scraper, 10)])
+
+        # An item whose lease has expired can be claimed by another worker
+        data.release_scrape(scraper, [claimed_rest[0]["mbid"]])
+        self.assertEqual(1, len(data.claim_scrape(scraper, 10, lease_seconds=-1)))
+        self.assertEqual(1, len(data.claim_scrape(scraper, 10)))
+
+    def test_scrape_queue_expired_lease_attempts(self):
+        mbid = "f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9"
+        data.add_recording_mbids([mbid])
+        source = data.add_source("test_source")
+        scraper = data.add_scraper(source, "module", "recording", "0.1", "desc")
+        data.enqueue_scrape(scraper, [mbid])
+
+        # A worker which never finishes the item, e.g. because it crashes
+        self.assertEqual([1], [c["attempts"] for c in data.claim_scrape(scraper, 10, lease_seconds=-1, max_attempts=2)])
+        self.assertEqual([2], [c["attempts"] for c in data.claim_scrape(scraper, 10, lease_seconds=-1, max_attempts=2)])
+        # The lease has expired again, but the item has had all its attempts
+        self.assertEqual([], data.claim_scrape(scraper, 10, max_attempts=2))
+        with data.db.engine.connect() as connection:
+            row = connection.execute("SELECT state, last_error FROM scrape_queue").fetchone()
+        self.assertEqual(("failed", "lease expired"), tuple(row))
+
+
 class MusicBrainzMetaTestCase(DatabaseTestCase):
     """Tests for the metadata tables
     recording_meta, recording_release_group, release_group, release_group_meta"""
@@ -433,3 +743,44 @@ class MusicBrainzMetaTestCase(DatabaseTestCase):
         self.assertEqual(rgs, [rgmbid1, rgmbid2])
         rgs = data.get_release_groups_for_recording(recmbid3)
         self.assertEqual(rgs, [rgmbid2])
+
+    def test_cache_musicbrainz_metadata_many(self):
+        recmbid1 = str(uuid.uuid4())
+        recmbid2 = str(uuid.uuid4())
+        rgmbid1 = str(uuid.uuid4())
+        rgmbid2 = str(uuid.uuid4())
+        data.add_recording_mbids([recmbid1, recmbid2])
+
+        old = datetime.datetime(2017, 4, 4, 3, 20, 30, tzinfo=pytz.utc)
+        new = datetime.datetime(2017, 4, 10, 13, 20, 30, tzinfo=pytz.utc)
+        rg1_old = {"mbid": rgmbid1, "name": "A release", "artist_credit": "Some artist",
+                   "first_release_date": "2012-03", "last_updated": old}
+        rg1_new = {"mbid": rgmbid1, "name": "A changed release", "artist_credit": "Some artist",
+                   "first_release_date": "2012-02", "last_updated": new}
+        rg2 = {"mbid": rgmbid2, "name": "Another release", "artist_credit": "Some artist",
+               "first_release_date": None, "last_updated": old}
+        rec1 = {"mbid": recmbid1, "name": "A song", "artist_credit": "Some artist", "last_updated": old,
+                "release_group_map": {rgmbid1: rg1_new}}
+        rec2 = {"mbid": recmbid2, "name": "Another song", "artist_credit": "Some artist", "last_updated": old,
+                "release_group_map": {rgmbid1: rg1_old, rgmbid2: rg2}}
+
+        data.cache_musicbrainz_metadata_many([rec1, rec2])
+        # The newest metadata for a release group is kept
+        self.assertEqual(rg1_new, data.get_release_group_meta(rgmbid1))
+        self.assertEqual(rg2, data.get_release_group_meta(rgmbid2))
+        self.assertEqual([rgmbid1], data.get_release_groups_for_recording(recmbid1))
+        self.assertCountEqual([rgmbid1, rgmbid2], data.get_release_groups_for_recording(recmbid2))
+        rec1_meta = data.get_recording_meta(recmbid1)
+        self.assertEqual("A song", rec1_meta["name"])
+
+        # Adding older data again doesn't change anything or duplicate links
+        rec1["release_group_map"] = {rgmbid1: rg1_old}
+        data.cache_musicbrainz_metadata(rec1)
+        self.assertEqual(rg1_new, data.get_release_group_meta(rgmbid1))
+        self.assertEqual([rgmbid1], data.get_release_groups_for_recording(recmbid1))
+
+        # Newer recording metadata replaces the old
+        rec1["name"] = "A new song title"
+        rec1["last_updated"] = new
+        data.cache_musicbrainz_metadata(rec1)
+        self.assertEqual("A new song title", data.get_recording_meta(recmbid1)["name"])
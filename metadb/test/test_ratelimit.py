@@ -0,0 +1,58 @@
+import asyncio
+import unittest
+
+import mock
+
+from metadb import ratelimit
+
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    @mock.patch("metadb.ratelimit.time.sleep")
+    @mock.patch("metadb.ratelimit.time.monotonic")
+    def test_acquire(self, monotonic, sleep):
+        monotonic.return_value = 100
+        bucket = ratelimit.TokenBucket(2, burst=2)
+
+        # The burst is available straight away
+        self.assertEqual(0, bucket.acquire())
+        self.assertEqual(0, bucket.acquire())
+        sleep.assert_not_called()
+
+        # Then one token every 1/rate seconds, in the order they were asked for
+        self.assertEqual(0.5, bucket.acquire())
+        self.assertEqual(1.0, bucket.acquire())
+        sleep.assert_has_calls([mock.call(0.5), mock.call(1.0)])
+
+    @mock.patch("metadb.ratelimit.time.sleep")
+    @mock.patch("metadb.ratelimit.time.monotonic")
+    def test_refill(self, monotonic, sleep):
+        monotonic.return_value = 100
+        bucket = ratelimit.TokenBucket(1, burst=3)
+        for _ in range(3):
+            bucket.acquire()
+
+        # Tokens come back over time, but never more than the burst
+        monotonic.return_value = 101
+        self.assertEqual(0, bucket.acquire())
+        self.assertEqual(1, bucket.acquire())
+        monotonic.return_value = 200
+        for _ in range(3):
+            self.assertEqual(0, bucket.acquire())
+        self.assertEqual(1, bucket.acquire())
+
+    @mock.patch("metadb.ratelimit.asyncio.sleep")
+    @mock.patch("metadb.ratelimit.time.monotonic")
+    def test_acquire_async(self, monotonic, sleep):
+        monotonic.return_value = 100
+        bucket = ratelimit.TokenBucket(4)
+
+        loop = asyncio.new_event_loop()
+        sleep.return_value = loop.create_future()
+        sleep.return_value.set_result(None)
+        try:
+            self.assertEqual(0, loop.run_until_complete(bucket.acquire_async()))
+            self.assertEqual(0.25, loop.run_until_complete(bucket.acquire_async()))
+        finally:
+            loop.close()
+        sleep.assert_called_once_with(0.25)
@@ -0,0 +1,134 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from metadb import segments
+
+
+class SegmentsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_read(self):
+        self.assertFalse(segments.is_segment_store(self.tmpdir))
+        writer = segments.SegmentWriter(self.tmpdir, segment_size=2)
+        for i in range(5):
+            writer.write("mbid%d" % i, {"n": i})
+        writer.close()
+
+        self.assertTrue(segments.is_segment_store(self.tmpdir))
+        self.assertEqual(["segment-000001.jsonl", "segment-000002.jsonl", "segment-000003.jsonl"],
+                         [os.path.basename(f) for f in segments.segment_filenames(self.tmpdir)])
+        self.assertEqual({"segment-000001.jsonl": 2, "segment-000002.jsonl": 2, "segment-000003.jsonl": 1},
+                         segments.read_index(self.tmpdir))
+        self.assertEqual([("mbid%d" % i, {"n": i}) for i in range(5)], list(segments.read_items(self.tmpdir)))
+        self.assertEqual(5, segments.count_items(self.tmpdir))
+        with open(os.path.join(self.tmpdir, "segment-000002.mbids")) as fp:
+            self.assertEqual("mbid2\nmbid3\n", fp.read())
+
+        # A new writer never changes existing segments
+        writer = segments.SegmentWriter(self.tmpdir, compress="gzip")
+        writer.write("mbid5", [1])
+        writer.close()
+        filename = os.path.join(self.tmpdir, "segment-000004.jsonl.gz")
+        with gzip.open(filename, "rt") as fp:
+            self.assertEqual('{"mbid": "mbid5", "payload": [1]}\n', fp.read())
+        self.assertEqual(["mbid%d" % i for i in range(6)], list(segments.read_mbids(self.tmpdir)))
+
+    def test_many_writers(self):
+        # Writers which start at the same time never write to the same segment
+        writer1 = segments.SegmentWriter(self.tmpdir)
+        writer2 = segments.SegmentWriter(self.tmpdir, compress="gzip")
+        writer3 = segments.SegmentWriter(self.tmpdir)
+        writer1.write("mbid1", 1)
+        writer2.write("mbid2", 2)
+        writer3.write("mbid3", 3)
+        for writer in [writer1, writer2, writer3]:
+            writer.close()
+
+        self.assertEqual(["segment-000001.jsonl", "segment-000002.jsonl.gz", "segment-000003.jsonl"],
+                         [os.path.basename(f) for f in segments.segment_filenames(self.tmpdir)])
+        self.assertEqual([("mbid1", 1), ("mbid2", 2), ("mbid3", 3)], list(segments.read_items(self.tmpdir)))
+
+    def test_unclosed_segment(self):
+        writer = segments.SegmentWriter(self.tmpdir)
+        writer.write("mbid1", {})
+        writer._fp.write('{"mbid": "mbid2", "pay')
+        writer._fp.flush()
+
+        # The segment isn't in the index, so it is counted by reading it
+        self.assertEqual({}, segments.read_index(self.tmpdir))
+        self.assertEqual(1, segments.count_items(self.tmpdir))
+        self.assertEqual([("mbid1", {})], list(segments.read_items(self.tmpdir)))
+        self.assertEqual(["mbid1"], list(segments.read_mbids(self.tmpdir)))
+        writer.close()
+
+    def test_many_segments(self):
+        writer = segments.SegmentWriter(self.tmpdir)
+        writer._number = 999998
+        for i in range(3):
+            writer.write("mbid%d" % i, i)
+            writer._close_segment()
+
+        self.assertEqual(["segment-999999.jsonl", "segment-1000000.jsonl", "segment-1000001.jsonl"],
+                         [os.path.basename(f) for f in segments.segment_filenames(self.tmpdir)])
+        self.assertEqual([("mbid%d" % i, i) for i in range(3)], list(segments.read_items(self.tmpdir)))
+        self.assertEqual(["mbid%d" % i for i in range(3)], list(segments.read_mbids(self.tmpdir)))
+        # A new writer carries on from the highest number
+        writer = segments.SegmentWriter(self.tmpdir)
+        writer.write("mbid3", 3)
+        writer.close()
+        self.assertEqual("segment-1000002.jsonl", os.path.basename(segments.segment_filenames(self.tmpdir)[-1]))
+
+    def _test_truncated_segment(self, compress, garbage):
+        writer = segments.SegmentWriter(self.tmpdir, compress=compress)
+        writer.write("mbid1", {})
+        writer.write("mbid2", {})
+        writer.close()
+        # The start of a block which the writer didn't finish
+        with open(segments.segment_filenames(self.tmpdir)[0], "ab") as fp:
+            fp.write(garbage)
+
+        with mock.patch("metadb.segments.log") as log:
+            self.assertEqual(["mbid1", "mbid2"], [mbid for mbid, _ in segments.read_items(self.tmpdir)])
+        log.warn.assert_called_once_with(mock.ANY)
+        self.assertIn("truncated", log.warn.call_args[0][0])
+
+    def test_truncated_gzip_segment(self):
+        self._test_truncated_segment("gzip", b"\x1f\x8b\x08\x00partofablock")
+
+    @unittest.skipUnless(zstandard, "zstandard is not installed")
+    def test_truncated_zstd_segment(self):
+        self._test_truncated_segment("zstd", b"\x28\xb5\x2f\xfd\x00partofablock")
+
+    def test_read_mbids_from_sidecar(self):
+        writer = segments.SegmentWriter(self.tmpdir, segment_size=2, compress="gzip")
+        for i in range(3):
+            writer.write("mbid%d" % i, {"n": i})
+        writer.close()
+        writer = segments.SegmentWriter(self.tmpdir)
+        writer.write("mbid3", {})
+        writer._fp.flush()
+
+        # Only the segment which isn't closed yet is read
+        with mock.patch("metadb.segments._read_segment", wraps=segments._read_segment) as read_segment:
+            self.assertEqual(["mbid0", "mbid1", "mbid2", "mbid3"], list(segments.read_mbids(self.tmpdir)))
+            read_segment.assert_called_once_with(os.path.join(self.tmpdir, "segment-000003.jsonl"))
+        writer.close()
+
+        # Stores written before sidecar files existed are read
+        os.remove(os.path.join(self.tmpdir, "segment-000001.mbids"))
+        self.assertEqual(["mbid0", "mbid1", "mbid2", "mbid3"], list(segments.read_mbids(self.tmpdir)))
@@ -1,6 +1,8 @@
 from metadb.testing import DatabaseTestCase
 from metadb import data
 
+import mock
+
 
 class StatsDatabaseTestCase(DatabaseTestCase):
 
@@ -51,4 +53,31 @@ class StatsDatabaseTestCase(DatabaseTestCase):
         # Removing a token
         data.remove_token(token)
         all_tokens = data.get_tokens()
-        self.assertEqual(0, len(all_tokens))
\ No newline at end of file
+        self.assertEqual(0, len(all_tokens))
+
+    def test_get_token_cached(self):
+        token = data.add_token()
+        data.get_token(token)
+        stats = data.get_token_cache_stats()
+        self.assertEqual(0, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+
+        # The second lookup doesn't go to the database
+        with mock.patch("metadb.data._load_token") as load_token:
+            self.assertEqual({"token": str(token), "admin": False}, data.get_token(token))
+            load_token.assert_not_called()
+        self.assertEqual(1, data.get_token_cache_stats()["hits"])
+
+        # Tokens which don't exist are also cached
+        missing = "02ce410a-8484-48cd-ad5b-6b5b57400a91"
+        data.get_token(missing)
+        with mock.patch("metadb.data._load_token") as load_token:
+            self.assertEqual({}, data.get_token(missing))
+            load_token.assert_not_called()
+
+    def test_remove_token_invalidates_cache(self):
+        token = data.add_token()
+        self.assertEqual({"token": str(token), "admin": False}, data.get_token(token))
+
+        data.remove_token(token)
+        self.assertEqual({}, data.get_token(token))
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from metadb import util
+
+
+class UtilTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_chunks_iter(self):
+        self.assertEqual([[0, 1], [2, 3], [4]], list(util.chunks_iter(iter(range(5)), 2)))
+        self.assertEqual([], list(util.chunks_iter([], 2)))
+
+    def test_open_file(self):
+        for name in ["test.csv", "test.csv.gz"]:
+            filename = os.path.join(self.tmpdir, name)
+            with util.open_file(filename, "wt") as fp:
+                fp.write("a,b\r\nc,d\r\n")
+            with util.open_file(filename) as fp:
+                self.assertEqual("a,b\r\nc,d\r\n", fp.read())
+            with open(filename, "rb") as rawfp:
+                with util.open_file(filename, "rt", rawfp) as fp:
+                    self.assertEqual("a,b\r\n", fp.readline())
+        with open(os.path.join(self.tmpdir, "test.csv.gz"), "rb") as fp:
+            self.assertEqual(b"\x1f\x8b", fp.read(2))
+
+    def test_uuid_ranges(self):
+        ranges = util.uuid_ranges(4)
+        self.assertEqual(4, len(ranges))
+        self.assertIsNone(ranges[0][0])
+        self.assertIsNone(ranges[-1][1])
+        self.assertEqual("40000000-0000-0000-0000-000000000000", ranges[0][1])
+        # Each range starts where the previous one ends
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+            uuid.UUID(start)
+
+        self.assertEqual([(None, None)], util.uuid_ranges(1))
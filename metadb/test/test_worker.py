@@ -0,0 +1,108 @@
+import concurrent.futures
+import datetime
+import unittest
+
+import mock
+import pytz
+
+from metadb.testing import DatabaseTestCase
+from metadb import data
+from metadb import worker
+
+
+class ScrapeWorkerTestCase(unittest.TestCase):
+
+    scraper = {"id": 1, "source_id": 1, "module": "metadb.scrapers.recording.lastfm",
+               "mb_type": "recording", "version": "1.0", "description": ""}
+
+    def _worker(self, scrape):
+        with mock.patch("metadb.scrapers.create_scraper_object") as create:
+            s_obj = mock.Mock()
+            s_obj.scrape.side_effect = scrape
+            create.return_value = s_obj
+            return worker.ScrapeWorker(self.scraper, 2)
+
+    @mock.patch("metadb.worker.data")
+    def test_process_batch(self, data):
+        def scrape(item):
+            if item["mbid"] == "b":
+                raise Exception("timeout")
+            return {"data": item["mbid"]}
+
+        w = self._worker(scrape)
+        w.save_results = mock.Mock()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            w.process_batch(executor, [{"mbid": "a"}, {"mbid": "b"}, {"mbid": "c"}])
+
+        self.assertCountEqual([("a", {"data": "a"}), ("c", {"data": "c"})], w.save_results.call_args[0][0])
+        data.fail_scrape.assert_called_once_with(self.scraper, "b", "timeout", 5)
+        data.release_scrape.assert_not_called()
+
+    @mock.patch("metadb.worker.data")
+    def test_stop_releases_items(self, data):
+        # Only the first item runs, and it stops the worker. The other
+        # items haven't started and are returned to the queue
+        class Executor(object):
+            def submit(self, fn, item):
+                future = concurrent.futures.Future()
+                if item["mbid"] == "a":
+                    future.set_result(fn(item))
+                return future
+
+        def scrape(item):
+            w.stop()
+            return {}
+
+        w = self._worker(scrape)
+        w.save_results = mock.Mock()
+        w.process_batch(Executor(), [{"mbid": "a"}, {"mbid": "b"}, {"mbid": "c"}])
+
+        w.save_results.assert_called_once_with([("a", {})])
+        data.release_scrape.assert_called_once_with(self.scraper, mock.ANY)
+        self.assertCountEqual(["b", "c"], data.release_scrape.call_args[0][1])
+
+    @mock.patch("metadb.worker.data")
+    def test_run_once(self, data):
+        w = self._worker(lambda item: {})
+        w.process_batch = mock.Mock()
+        data.claim_scrape.side_effect = [[{"mbid": "a"}], []]
+        w.run(once=True)
+
+        self.assertEqual(1, w.process_batch.call_count)
+        data.claim_scrape.assert_called_with(self.scraper, 8, 600, 5)
+        w.s_obj.config.assert_called_once_with()
+        w.s_obj.dispose.assert_called_once_with()
+
+
+class ScrapeWorkerDatabaseTestCase(DatabaseTestCase):
+
+    def test_save_results_musicbrainz(self):
+        recmbid = "f84ca3bf-e561-41bb-9ba3-f8b7d79e3af9"
+        rgmbid = "4410602a-7ecc-43a3-94d0-cae6905dffa4"
+        data.add_recording_mbids([recmbid])
+        source = data.add_source("musicbrainz")
+        scraper = data.add_scraper(source, "metadb.scrapers.recording.musicbrainz", "recording", "0.1", "desc")
+        data.enqueue_scrape(scraper, [recmbid])
+        with mock.patch("metadb.scrapers.create_scraper_object"):
+            w = worker.ScrapeWorker(scraper, 2)
+
+        now = datetime.datetime(2017, 4, 4, 3, 20, 30, tzinfo=pytz.utc)
+        rg = {"mbid": rgmbid, "name": "A release", "artist_credit": "Some artist",
+              "first_release_date": None, "last_updated": now}
+        recording = {"mbid": recmbid, "name": "A song", "artist_credit": "Some artist", "last_updated": now,
+                     "release_group_map": {rgmbid: rg}}
+
+        # If the metadata can't be written, the item stays in the queue
+        with mock.patch("metadb.data._add_links_recording_release_group_many") as add_links:
+            add_links.side_effect = Exception("failed")
+            with self.assertRaises(Exception):
+                w.save_results([(recmbid, recording)])
+        self.assertIsNone(data.load_item(recmbid, "musicbrainz"))
+        self.assertIsNone(data.get_recording_meta(recmbid))
+        self.assertEqual(1, len(data.claim_scrape(scraper, 10, lease_seconds=-1)))
+
+        w.save_results([(recmbid, recording)])
+        self.assertEqual("A song", data.load_item(recmbid, "musicbrainz")["data"]["name"])
+        self.assertEqual("A song", data.get_recording_meta(recmbid)["name"])
+        self.assertEqual([rgmbid], data.get_release_groups_for_recording(recmbid))
+        self.assertEqual([], data.claim_scrape(scraper, 10))
@@ -1,3 +1,4 @@
+from metadb import data
 from metadb import db
 import unittest
 import os
@@ -14,6 +15,8 @@ class DatabaseTestCase(unittest.TestCase):
     def setUp(self):
         db.init_db_engine(config.SQLALCHEMY_TEST_URI)
         self.reset_db()
+        data.clear_token_cache()
+        data.clear_registry()
 
     def tearDown(self):
         pass
@@ -27,6 +30,7 @@ class DatabaseTestCase(unittest.TestCase):
         db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_types.sql'))
         db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_tables.sql'))
         db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_primary_keys.sql'))
+        db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_constraints.sql'))
         db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_foreign_keys.sql'))
         db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_indexes.sql'))
 
@@ -1,7 +1,11 @@
 import os
 import errno
+import gzip
+import io
+import itertools
 import time
 import datetime
+import uuid
 
 
 def chunks(l, n):
@@ -10,6 +14,45 @@ def chunks(l, n):
         yield l[i:i+n]
 
 
+def chunks_iter(iterable, n):
+    """Yield successive lists of up to n items from any iterable,
+    without reading the whole iterable into memory."""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+def open_file(filename, mode="rt", fileobj=None):
+    """Open a file for reading or writing text. Files ending in .gz are
+    compressed with gzip and files ending in .zst with zstd (which needs the
+    zstandard package).
+    If `fileobj` is given, it is an already opened binary file for `filename`."""
+    if filename.endswith(".gz"):
+        return gzip.open(fileobj or filename, mode, newline="")
+    elif filename.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("zstandard must be installed to use .zst files")
+        return zstandard.open(fileobj or filename, mode, newline="")
+    if fileobj:
+        return io.TextIOWrapper(fileobj, newline="")
+    return open(filename, mode.replace("t", ""), newline="")
+
+
+def uuid_ranges(n):
+    """Split the UUID space into n ranges of the same size.
+    Returns a list of (start, end) UUID strings, where start is inclusive and
+    end is exclusive. The start of the first range and end of the last range are None.
+    MusicBrainz ids are random, so each range has about the same number of them."""
+    size = 2**128 // n
+    bounds = [str(uuid.UUID(int=size * i)) for i in range(1, n)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
 def mkdir_p(path):
     try:
         os.makedirs(path)
@@ -0,0 +1,122 @@
+""" A long-running worker which scrapes items from the scrape_queue table.
+
+Each worker repeatedly claims a batch of items for a scraper, runs the
+scraper module's scrape() on them with a pool of threads, and writes all
+of the results in one transaction. Any number of workers can run at once
+for the same scraper.
+"""
+
+import concurrent.futures
+import signal
+import time
+
+import metadb.scrapers
+from metadb import data
+from metadb import db
+from metadb import log
+
+
+class ScrapeWorker(object):
+
+    def __init__(self, scraper, concurrency, batch_size=None, lease_seconds=600,
+                 max_attempts=5, poll_interval=30):
+        """
+        :param scraper: the scraper to process items for
+        :param concurrency: the number of items to scrape at once
+        :param batch_size: the number of items to claim at once, defaults to 4 * concurrency
+        :param lease_seconds: claimed items which aren't finished after this time are
+                              given to another worker
+        :param max_attempts: the number of times to try an item before giving up on it
+        :param poll_interval: seconds to wait before checking an empty queue again
+        """
+        self.scraper = scraper
+        self.concurrency = concurrency
+        self.batch_size = batch_size or concurrency * 4
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.stopping = False
+        self.s_obj = metadb.scrapers.create_scraper_object(scraper)
+
+    def stop(self, signum=None, frame=None):
+        """Finish the items which are being scraped, give back the ones which
+        haven't started, and exit"""
+        if not self.stopping:
+            log.info("Stopping after the current items")
+        self.stopping = True
+
+    def run(self, once=False):
+        """Process items until stop() is called.
+        If `once` is True, also stop when the queue is empty."""
+        self.s_obj.config()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                while not self.stopping:
+                    items = data.claim_scrape(self.scraper, self.batch_size, self.lease_seconds, self.max_attempts)
+                    if not items:
+                        if once:
+                            break
+                        self._sleep(self.poll_interval)
+                        continue
+                    self.process_batch(executor, items)
+        finally:
+            self.s_obj.dispose()
+
+    def _sleep(self, seconds):
+        end = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < end:
+            time.sleep(max(0, min(1, end - time.monotonic())))
+
+    def process_batch(self, executor, items):
+        future_to_item = {executor.submit(self.s_obj.scrape, i): i for i in items}
+        results = []
+        failed = []
+        released = []
+        pending = set(future_to_item)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                item = future_to_item[future]
+                try:
+                    results.append((item["mbid"], future.result()))
+                except Exception as e:
+                    failed.append((item["mbid"], str(e)))
+            if self.stopping:
+                # Items which haven't started yet are given back to the queue
+                for future in list(pending):
+                    if future.cancel():
+                        released.append(future_to_item[future]["mbid"])
+                        pending.remove(future)
+
+        self.save_results(results)
+        for mbid, error in failed:
+            log.warn("%s: %s", mbid, error)
+            data.fail_scrape(self.scraper, mbid, error, self.max_attempts)
+        if released:
+            data.release_scrape(self.scraper, released)
+        log.info("Scraped %s items, %s failed, %s returned to the queue",
+                 len(results), len(failed), len(released))
+
+    def save_results(self, results):
+        """Add items, their musicbrainz metadata, and mark them complete in a
+        single transaction, so that an item is never complete without its metadata"""
+        if not results:
+            return
+        with db.engine.begin() as connection:
+            data._add_items_bulk_w_connection(connection, self.scraper, results)
+            if self.scraper["module"] == "metadb.scrapers.recording.musicbrainz":
+                recordings = [r for _, r in results if r]
+                for mbid, r in results:
+                    if r:
+                        data._musicbrainz_check_mbid_redirect_w_connection(connection, mbid, r["mbid"])
+                data._cache_musicbrainz_metadata_many_w_connection(connection, recordings)
+            data._complete_scrape_w_connection(connection, self.scraper, [mbid for mbid, _ in results])
+
+
+def run(scraper, concurrency, batch_size=None, once=False):
+    """Scrape items of `scraper` until the process is stopped with SIGTERM or SIGINT"""
+    worker = ScrapeWorker(scraper, concurrency, batch_size)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    log.info("Scraping with %s version %s with %s workers", scraper["module"], scraper["version"], concurrency)
+    worker.run(once=once)
@@ -1,4 +1,5 @@
 from flask import Flask
+from metadb import data
 from metadb import db
 import sys
 import os
@@ -43,12 +44,13 @@ def create_app(web=True):
         app.register_blueprint(index_bp)
         app.register_blueprint(api_bp)
 
-    @app.before_request
-    def before_request():
-        db.init_db_engine(app.config['SQLALCHEMY_DATABASE_URI'])
-
-    @app.teardown_appcontext
-    def shutdown_session(exception=None):
-        db.engine.dispose()
+    # Database. One pooled engine is shared by every request in this process
+    if app.config['SQLALCHEMY_DATABASE_URI']:
+        db.init_db_engine(app.config['SQLALCHEMY_DATABASE_URI'],
+                          pool_size=app.config['SQLALCHEMY_POOL_SIZE'],
+                          max_overflow=app.config['SQLALCHEMY_MAX_OVERFLOW'],
+                          pool_recycle=app.config['SQLALCHEMY_POOL_RECYCLE'],
+                          pool_pre_ping=app.config['SQLALCHEMY_POOL_PRE_PING'])
+    data.REGISTRY_REFRESH_INTERVAL = app.config['REGISTRY_REFRESH_INTERVAL']
 
     return app
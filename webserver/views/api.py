@@ -11,6 +11,14 @@ import metadb.jobs
 
 api_bp = Blueprint('api', __name__)
 
+# The largest number of mbids which can be requested from /items at once
+MAX_ITEMS_MBIDS = 1000
+# The largest number of sources which can be requested from /items at once
+MAX_ITEMS_SOURCES = 20
+
+# The largest page of mbids which can be requested from /tag
+MAX_TAG_LIMIT = 1000
+
 
 @api_bp.route("/recordings", methods=["POST"])
 @webserver.decorators.admin_required
@@ -57,9 +65,15 @@ def scrape(source_name, mbid=None):
     scraper = metadb.data.load_latest_scraper_for_source(source)
 
     if scraper["mb_type"] == "recording":
-        metadata = metadb.data.get_unprocessed_recordings_for_scraper(scraper, mbid)
+        if mbid:
+            metadata = metadb.data.get_unprocessed_recordings_for_scraper(scraper, mbid)
+        else:
+            metadata = metadb.data.iter_unprocessed_recordings_for_scraper(scraper)
     elif scraper["mb_type"] == "release_group":
-        metadata = metadb.data.get_unprocessed_release_groups_for_scraper(scraper, mbid)
+        if mbid:
+            metadata = metadb.data.get_unprocessed_release_groups_for_scraper(scraper, mbid)
+        else:
+            metadata = metadb.data.iter_unprocessed_release_groups_for_scraper(scraper)
 
     for m in metadata:
         metadb.jobs.scrape.delay(scraper, m)
@@ -67,10 +81,84 @@ def scrape(source_name, mbid=None):
     return jsonify({})
 
 
+@api_bp.route("/cache_stats")
+@webserver.decorators.admin_required
+def cache_stats():
+    """Hit and miss counts of the in-process caches of this server process"""
+    return jsonify({"token": metadb.data.get_token_cache_stats()})
+
+
 @api_bp.route("/<uuid:mbid>/<source_name>")
 def load(mbid, source_name):
-    data = metadb.data.load_item(mbid, source_name)
+    data = metadb.data.load_item(mbid, source_name, follow_redirects=True)
     if not data:
         raise webserver.exceptions.APINotFound("Not found")
     return jsonify(data)
 
+
+@api_bp.route("/items", methods=["POST"])
+def load_many():
+    """Load items for many mbids from many sources.
+    The body must be {"mbids": [mbid, ...], "sources": [source_name, ...]}
+    Returns {"items": {mbid: {source_name: item}}, "missing": {source_name: [mbid, ...]}},
+    where items which don't exist are null."""
+    data = request.get_json()
+    if not isinstance(data, dict):
+        raise webserver.exceptions.APIBadRequest("Submitted data must be an object")
+    mbids = data.get("mbids")
+    sources = data.get("sources")
+    if not isinstance(mbids, list) or not isinstance(sources, list):
+        raise webserver.exceptions.APIBadRequest("mbids and sources must be lists")
+    if len(mbids) > MAX_ITEMS_MBIDS:
+        raise webserver.exceptions.APIBadRequest("Cannot request more than {} mbids".format(MAX_ITEMS_MBIDS))
+    if len(sources) > MAX_ITEMS_SOURCES:
+        raise webserver.exceptions.APIBadRequest("Cannot request more than {} sources".format(MAX_ITEMS_SOURCES))
+    if not all(isinstance(s, str) and s for s in sources):
+        raise webserver.exceptions.APIBadRequest("sources must be source names")
+    try:
+        mbids = [str(uuid.UUID(str(m))) for m in mbids]
+    except ValueError:
+        raise webserver.exceptions.APIBadRequest("mbids must be valid UUIDs")
+
+    items = {m: {} for m in mbids}
+    missing = {}
+    for source_name in sources:
+        found = metadb.data.load_items(mbids, source_name, follow_redirects=True)
+        missing[source_name] = []
+        for m in mbids:
+            items[m][source_name] = found.get(m)
+            if m not in found:
+                missing[source_name].append(m)
+    return jsonify({"items": items, "missing": missing})
+
+
+@api_bp.route("/tag/<tag>")
+def load_tag(tag):
+    """Get mbids of items from a source which have a tag, highest weight first.
+    Query arguments are source (required), limit, and after_weight and after_mbid
+    from the "next" value of the previous page.
+    Returns {"mbids": [{"mbid": mbid, "weight": weight}, ...], "next": {...} or null}"""
+    source_name = request.args.get("source")
+    if not source_name:
+        raise webserver.exceptions.APIBadRequest("source is required")
+    try:
+        limit = int(request.args.get("limit", 100))
+    except ValueError:
+        raise webserver.exceptions.APIBadRequest("limit must be a number")
+    if limit < 1 or limit > MAX_TAG_LIMIT:
+        raise webserver.exceptions.APIBadRequest("limit must be between 1 and {}".format(MAX_TAG_LIMIT))
+
+    after = None
+    after_weight = request.args.get("after_weight")
+    after_mbid = request.args.get("after_mbid")
+    if after_weight is not None or after_mbid is not None:
+        try:
+            after = (int(after_weight), str(uuid.UUID(after_mbid)))
+        except (TypeError, ValueError):
+            raise webserver.exceptions.APIBadRequest("after_weight and after_mbid must both be given")
+
+    mbids = metadb.data.get_mbids_for_tag(tag, source_name, after, limit)
+    next_page = None
+    if len(mbids) == limit:
+        next_page = {"after_weight": mbids[-1]["weight"], "after_mbid": mbids[-1]["mbid"]}
+    return jsonify({"mbids": mbids, "next": next_page})
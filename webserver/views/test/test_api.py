@@ -78,4 +78,76 @@ class TestRecordingSubmit(testing.ServerTestCase):
     def test_submit(self, add_recording_mbids, get_token):
         # Call correct submit method
         get_token.return_value = get_token.return_value = {"token": self.id, "admin": True}
-        pass
\ No newline at end of file
+        pass
+
+
+class TestLoadMany(testing.ServerTestCase):
+
+    def _submit(self, data):
+        return self.client.post("/items",
+                                data=json.dumps(data),
+                                content_type="application/json")
+
+    @mock.patch("metadb.data.load_items")
+    def test_load_many(self, load_items):
+        mbid1 = "e0efcfa8-0b4e-43e7-bae2-5feccf55045f"
+        mbid2 = "924232e9-a1d6-45e9-aa1a-5de419c44921"
+        load_items.side_effect = [{mbid1: {"mbid": mbid1, "data": {"a": 1}}}, {}]
+
+        resp = self._submit({"mbids": [mbid1, mbid2.upper()], "sources": ["lastfm", "discogs"]})
+        self.assertEqual(200, resp.status_code)
+        expected = {"items": {mbid1: {"lastfm": {"mbid": mbid1, "data": {"a": 1}}, "discogs": None},
+                              mbid2: {"lastfm": None, "discogs": None}},
+                    "missing": {"lastfm": [mbid2], "discogs": [mbid1, mbid2]}}
+        self.assertEqual(expected, resp.json)
+        load_items.assert_has_calls([mock.call([mbid1, mbid2], "lastfm", follow_redirects=True),
+                                     mock.call([mbid1, mbid2], "discogs", follow_redirects=True)])
+
+    @mock.patch("metadb.data.load_items")
+    def test_load_many_bad_data(self, load_items):
+        resp = self._submit(["e0efcfa8-0b4e-43e7-bae2-5feccf55045f"])
+        self.assertEqual(400, resp.status_code)
+
+        resp = self._submit({"mbids": ["not-a-uuid"], "sources": ["lastfm"]})
+        self.assertEqual(400, resp.status_code)
+
+        with mock.patch("webserver.views.api.MAX_ITEMS_MBIDS", 1):
+            resp = self._submit({"mbids": ["e0efcfa8-0b4e-43e7-bae2-5feccf55045f",
+                                           "924232e9-a1d6-45e9-aa1a-5de419c44921"], "sources": ["lastfm"]})
+            self.assertEqual(400, resp.status_code)
+
+        mbid = "e0efcfa8-0b4e-43e7-bae2-5feccf55045f"
+        for sources in [["lastfm", 1], ["lastfm", None], [""], [["lastfm"]]]:
+            resp = self._submit({"mbids": [mbid], "sources": sources})
+            self.assertEqual(400, resp.status_code)
+
+        with mock.patch("webserver.views.api.MAX_ITEMS_SOURCES", 1):
+            resp = self._submit({"mbids": [mbid], "sources": ["lastfm", "discogs"]})
+            self.assertEqual(400, resp.status_code)
+        load_items.assert_not_called()
+
+
+class TestLoadTag(testing.ServerTestCase):
+
+    @mock.patch("metadb.data.get_mbids_for_tag")
+    def test_load_tag(self, get_mbids_for_tag):
+        mbid = "e0efcfa8-0b4e-43e7-bae2-5feccf55045f"
+        get_mbids_for_tag.return_value = [{"mbid": mbid, "weight": 10}]
+
+        resp = self.client.get("/tag/rock?source=lastfm&limit=1")
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual({"mbids": [{"mbid": mbid, "weight": 10}],
+                          "next": {"after_weight": 10, "after_mbid": mbid}}, resp.json)
+        get_mbids_for_tag.assert_called_with("rock", "lastfm", None, 1)
+
+        resp = self.client.get("/tag/rock?source=lastfm&after_weight=10&after_mbid=" + mbid)
+        self.assertEqual(200, resp.status_code)
+        self.assertIsNone(resp.json["next"])
+        get_mbids_for_tag.assert_called_with("rock", "lastfm", (10, mbid), 100)
+
+    @mock.patch("metadb.data.get_mbids_for_tag")
+    def test_load_tag_bad_args(self, get_mbids_for_tag):
+        self.assertEqual(400, self.client.get("/tag/rock").status_code)
+        self.assertEqual(400, self.client.get("/tag/rock?source=lastfm&limit=0").status_code)
+        self.assertEqual(400, self.client.get("/tag/rock?source=lastfm&after_weight=10").status_code)
+        get_mbids_for_tag.assert_not_called()